@@ -0,0 +1,447 @@
+import argparse
+import csv
+import functools
+import itertools
+import json
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from fitting_profile import FREQUENCIES
+
+# Streaming import of clinic audiogram exports.
+#
+# A record is the audiogram of one ear. Supported formats:
+#
+#   CSV (.csv): one record per row; an id column (id, patient, patient_id),
+#       an ear column (ear, side) and one column per tested frequency
+#       ("250", "1k", "1000 Hz", ...). Blank cells are untested.
+#   JSON Lines (.jsonl, .ndjson):
+#       {"id": ..., "ear": "left", "thresholds": {"250": 20, ...}}
+#   XML (.xml): audiometer exports with
+#       <Audiogram id="..." ear="left"><Point frequency="250" threshold="20"/>
+#       ...</Audiogram> elements anywhere in the document.
+#
+# Thresholds must be within 0..80 dB HL; records with invalid values are
+# rejected (counted in ImportStats). Tested frequencies are mapped onto the
+# fitting grid by linear interpolation over log frequency; grid bands
+# outside the tested range are NaN. Records come out in batches of
+# (ids, ears, thresholds[batch, bands]) and only one batch is held at a
+# time, so memory stays constant regardless of file size.
+
+MIN_THRESHOLD_dB = 0
+MAX_THRESHOLD_dB = 80
+
+EARS = {"l": "left", "left": "left", "as": "left",
+    "r": "right", "right": "right", "ad": "right"}
+
+ID_COLUMNS = ["id", "patient", "patient_id"]
+EAR_COLUMNS = ["ear", "side"]
+
+# At most this many error messages are kept in ImportStats.
+MAX_ERRORS = 100
+
+class AudiogramFormatError(ValueError):
+    pass
+
+class ImportStats(object):
+    def __init__(self):
+        self.records = 0
+        self.rejected = 0
+        self.batches = 0
+        self.errors = []
+
+    def reject(self, where, msg):
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(f"{where}: {msg}")
+
+    def __repr__(self):
+        return (f"ImportStats(records={self.records},"
+            f" rejected={self.rejected}, batches={self.batches})")
+
+_FREQUENCY = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(k?)\s*(?:hz)?\s*$",
+    re.IGNORECASE)
+
+# "250", "250Hz", "1k", "1.5 kHz" -> Hz; None if not a frequency.
+def parse_frequency(text):
+    match = _FREQUENCY.match(str(text))
+    if match is None:
+        return None
+    value = float(match.group(1))
+    if value <= 0:
+        return None
+    return value * 1000 if match.group(2) else value
+
+def map_to_grid(tested, thresholds, grid=FREQUENCIES):
+    order = np.argsort(tested)
+    return np.interp(np.log2(grid), np.log2(np.asarray(tested)[order]),
+        np.asarray(thresholds)[order], left=np.nan, right=np.nan)
+
+# (tested x grid) matrix doing map_to_grid for complete records; columns
+# of grid bands outside the tested range are NaN.
+@functools.lru_cache(maxsize=64)
+def _grid_weights(tested, grid):
+    return np.stack([np.interp(np.log2(grid), np.log2(tested), row,
+        left=np.nan, right=np.nan) for row in np.eye(len(tested))])
+
+# Readers yield (where, id, ear, tested frequencies (tuple), raw values)
+# per record and report malformed records to stats themselves.
+
+# CSV header -> (id column or None, ear column, tested frequencies,
+# their column indices).
+def _csv_columns(header):
+    lower = [name.lower() for name in header]
+    id_col = next((lower.index(c) for c in ID_COLUMNS if c in lower), None)
+    ear_col = next((lower.index(c) for c in EAR_COLUMNS if c in lower), None)
+    if ear_col is None:
+        raise AudiogramFormatError(f"No ear column in CSV header {header}")
+    columns = [(i, parse_frequency(name)) for i, name in enumerate(header)]
+    columns = [(i, freq) for i, freq in columns if freq is not None]
+    if not columns:
+        raise AudiogramFormatError(f"No frequency columns in CSV header"
+            f" {header}")
+    return (id_col, ear_col, tuple(freq for _, freq in columns),
+        [i for i, _ in columns])
+
+def _csv_records(reader, first, header, stats):
+    id_col, ear_col, tested, indices = _csv_columns(header)
+    for line, row in enumerate(reader, first):
+        if not row:
+            continue
+        if len(row) != len(header):
+            stats.reject(f"line {line}", f"{len(row)} columns, expected"
+                f" {len(header)}")
+            continue
+        yield (f"line {line}", row[id_col] if id_col is not None else "",
+            row[ear_col], tested, [row[i] for i in indices])
+
+def _read_csv(f, stats):
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        raise AudiogramFormatError("Empty CSV file, no header")
+    header = [name.strip() for name in header]
+    yield from _csv_records(reader, 2, header, stats)
+
+def _read_jsonl(f, stats):
+    for line, text in enumerate(f, 1):
+        if not text.strip():
+            continue
+        where = f"line {line}"
+        try:
+            record = json.loads(text)
+            points = record["thresholds"]
+            if not isinstance(points, dict):
+                raise TypeError(f"thresholds must be an object, not"
+                    f" {type(points).__name__}")
+            tested = tuple(parse_frequency(freq) for freq in points)
+            values = list(points.values())
+            ear = record["ear"]
+            record_id = record.get("id", "")
+        except (ValueError, KeyError, AttributeError, TypeError) as e:
+            stats.reject(where, f"bad record: {e!r}")
+            continue
+        if None in tested:
+            stats.reject(where, f"bad frequency in {list(points)}")
+            continue
+        yield where, record_id, ear, tested, values
+
+# A malformed document (e.g. truncated) stops the import with
+# AudiogramFormatError; the records before the error have been yielded.
+def _read_xml(f, stats, record_tag="Audiogram", point_tag="Point"):
+    try:
+        yield from _iter_xml(f, stats, record_tag, point_tag)
+    except ET.ParseError as e:
+        raise AudiogramFormatError(f"Malformed XML: {e}") from e
+
+def _iter_xml(f, stats, record_tag, point_tag):
+    context = ET.iterparse(f, events=("start", "end"))
+    _, root = next(context)
+    n = 0
+    for event, elem in context:
+        if event != "end" or elem.tag != record_tag:
+            continue
+        n += 1
+        points = [(parse_frequency(p.get("frequency")), p.get("threshold"))
+            for p in elem.iter(point_tag)]
+        tested = tuple(freq for freq, _ in points)
+        if None in tested:
+            stats.reject(f"record {n}", "bad frequency")
+        else:
+            yield (f"record {n}", elem.get("id", ""), elem.get("ear"),
+                tested, [value for _, value in points])
+        # Drop the parsed record and the references the tree keeps to it.
+        elem.clear()
+        root.clear()
+
+READERS = {
+    ".csv": _read_csv,
+    ".jsonl": _read_jsonl,
+    ".ndjson": _read_jsonl,
+    ".xml": _read_xml,
+}
+
+def _open(path, fmt):
+    if fmt == ".xml":
+        return open(path, "rb")
+    return open(path, newline="", encoding="utf-8")
+
+def _float(value):
+    if value is None or str(value).strip() == "":
+        return np.nan # Not tested
+    return float(value)
+
+# Raw values -> (records x tested) floats, NaN where not tested. Rows that
+# do not parse are rejected (and left NaN).
+def _parse_values(block, rows, stats):
+    raw = [block[i][4] for i in rows]
+    try:
+        return np.array([[v if v != "" else "nan" for v in values]
+            for values in raw], dtype=float), []
+    except (ValueError, TypeError):
+        pass
+    values = np.full((len(rows), len(raw[0])), np.nan)
+    rejected = []
+    for k, i in enumerate(rows):
+        try:
+            values[k] = [_float(v) for v in raw[k]]
+        except (ValueError, TypeError):
+            stats.reject(block[i][0], f"non numeric threshold in {raw[k]}")
+            rejected.append(k)
+    return values, rejected
+
+# A parsed block is (where(i), ids, raw ears, groups), groups being
+# (tested frequencies, row indices, values[rows, tested], rejected rows)
+# with the rows that share tested frequencies.
+
+# Groups raw records by tested frequencies and parses their values.
+def _parse_block(block, stats):
+    groups = {}
+    for i, record in enumerate(block):
+        groups.setdefault(record[3], []).append(i)
+    parsed = []
+    for tested, rows in groups.items():
+        values, rejected = _parse_values(block, rows, stats)
+        parsed.append((tested, np.array(rows), values, rejected))
+    return (lambda i: block[i][0], [record[1] for record in block],
+        [record[2] for record in block], parsed)
+
+# Validates a parsed block and maps it onto the grid; each group is one
+# matrix product.
+def _convert(block, grid, stats):
+    where, ids, raw_ears, groups = block
+    grid = tuple(grid)
+    out = np.full((len(ids), len(grid)), np.nan, dtype=np.float32)
+    valid = np.ones(len(ids), dtype=bool)
+    # A block has only a handful of distinct ear spellings.
+    keys = list(map(str, raw_ears))
+    known = {key: EARS.get(key.strip().lower()) for key in set(keys)}
+    ears = [known[key] for key in keys]
+
+    for tested, rows, values, rejected in groups:
+        valid[rows[rejected]] = False
+        keep = np.ones(len(rows), dtype=bool)
+        keep[rejected] = False
+
+        with np.errstate(invalid="ignore"):
+            out_of_range = (values < MIN_THRESHOLD_dB) \
+                | (values > MAX_THRESHOLD_dB)
+        untested = np.isnan(values)
+        for k in np.flatnonzero(keep & out_of_range.any(axis=1)):
+            j = np.flatnonzero(out_of_range[k])[0]
+            stats.reject(where(rows[k]), f"threshold {values[k, j]:g}"
+                f" dB at {tested[j]:g} Hz out of accepted range")
+        for k in np.flatnonzero(keep & untested.all(axis=1)):
+            stats.reject(where(rows[k]), "no thresholds")
+        keep &= ~out_of_range.any(axis=1) & ~untested.all(axis=1)
+
+        order = np.argsort(tested)
+        sorted_tested = tuple(np.asarray(tested)[order])
+        complete = keep & ~untested.any(axis=1)
+        if complete.any():
+            out[rows[complete]] = values[complete][:, order] \
+                @ _grid_weights(sorted_tested, grid)
+        for k in np.flatnonzero(keep & ~complete):
+            measured = ~untested[k]
+            out[rows[k]] = map_to_grid(np.asarray(tested)[measured],
+                values[k, measured], grid)
+        valid[rows[~keep]] = False
+
+    if None in known.values():
+        unknown = valid & np.array([ear is None for ear in ears])
+        for i in np.flatnonzero(unknown):
+            stats.reject(where(i), f"unknown ear {raw_ears[i]!r}")
+        valid &= ~unknown
+    ids = list(itertools.compress(ids, valid))
+    ears = list(itertools.compress(ears, valid))
+    stats.records += len(ids)
+    return ids, ears, out[valid]
+
+def _parsed_blocks(records, batch_size, stats):
+    for block in iter(lambda: list(itertools.islice(records, batch_size)),
+            []):
+        yield _parse_block(block, stats)
+
+# Plain CSV block (no quotes, no blank cells, every row complete) parsed
+# in bulk: np.loadtxt converts the threshold columns in C and only the id
+# and ear cells are split out in Python. None if the block is not plain.
+def _plain_csv_block(lines, text, first, n_columns, columns):
+    id_col, ear_col, tested, indices = columns
+    if text.count(",") != len(lines) * (n_columns - 1):
+        return None
+    try:
+        values = np.loadtxt(lines, delimiter=",", usecols=indices,
+            dtype=float, ndmin=2, comments=None)
+    except ValueError:
+        return None # Blank or non numeric cells
+    if len(values) != len(lines):
+        return None # Blank lines
+    last = max(ear_col, -1 if id_col is None else id_col)
+    cells = [line.split(",", last + 1) for line in lines]
+    if id_col is None:
+        ids = [""] * len(lines)
+    elif id_col == n_columns - 1:
+        ids = [row[id_col].rstrip("\r\n") for row in cells]
+    else:
+        ids = [row[id_col] for row in cells]
+    return (lambda i: f"line {first + i}", ids,
+        [row[ear_col] for row in cells],
+        [(tested, np.arange(len(lines)), values, [])])
+
+# Most exports are plain, so blocks of lines go through _plain_csv_block;
+# the others are parsed row by row with csv. Quoted cells may span lines,
+# so from the first quote on the rest of the file is left to csv.
+def _csv_blocks(f, batch_size, stats):
+    line = next(f, None)
+    if line is None:
+        raise AudiogramFormatError("Empty CSV file, no header")
+    header = [name.strip() for name in next(csv.reader([line]), [])]
+    columns = _csv_columns(header)
+    first = 2
+    while True:
+        lines = list(itertools.islice(f, batch_size))
+        if not lines:
+            return
+        text = "".join(lines)
+        if '"' in text:
+            records = _csv_records(csv.reader(itertools.chain(lines, f)),
+                first, header, stats)
+            yield from _parsed_blocks(records, batch_size, stats)
+            return
+        block = _plain_csv_block(lines, text, first, len(header), columns)
+        if block is None:
+            block = _parse_block(list(_csv_records(csv.reader(lines), first,
+                header, stats)), stats)
+        yield block
+        first += len(lines)
+
+def _blocks(path, batch_size, stats, fmt):
+    fmt = fmt or os.path.splitext(path)[1].lower()
+    if fmt not in READERS:
+        raise AudiogramFormatError(f"Unknown audiogram format: {path}")
+    with _open(path, fmt) as f:
+        if fmt == ".csv":
+            yield from _csv_blocks(f, batch_size, stats)
+        else:
+            yield from _parsed_blocks(READERS[fmt](f, stats), batch_size,
+                stats)
+
+# Yields (ids, ears, thresholds) batches of up to batch_size valid
+# records; thresholds is a float32 (batch, bands) array with NaN for
+# untested bands.
+def import_audiograms(path, batch_size=4096, frequencies=FREQUENCIES,
+        stats=None, fmt=None):
+    if stats is None:
+        stats = ImportStats()
+    for block in _blocks(path, batch_size, stats, fmt):
+        ids, ears, thresholds = _convert(block, frequencies, stats)
+        if ids:
+            stats.batches += 1
+            yield ids, ears, thresholds
+
+# Both ears of one record id (the first record's if None):
+# {"left": [...], "right": [...]} with the ears found (first match). Stops
+# reading once both are found.
+def find_audiogram(path, record_id=None, frequencies=FREQUENCIES, fmt=None):
+    found = {}
+    for ids, ears, thresholds in import_audiograms(path, 256, frequencies,
+            fmt=fmt):
+        for found_id, ear, values in zip(ids, ears, thresholds):
+            if record_id is None:
+                record_id = found_id
+            if str(found_id) == str(record_id) and ear not in found:
+                found[ear] = values.tolist()
+        if len(found) == 2:
+            break
+    return found
+
+#################
+### BENCHMARK ###
+#################
+def _write_csv(path, n_records, rng):
+    # Clinic exports test more (and other) frequencies than the grid.
+    tested = [125, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 6000, 8000]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["patient_id", "ear"] + [f"{freq} Hz"
+            for freq in tested])
+        for i in range(n_records):
+            row = rng.integers(0, 81, len(tested)).tolist()
+            if i % 100 == 0:
+                row[-1] = 95 # Out of range; rejected
+            writer.writerow([i // 2, "LR"[i % 2]] + row)
+
+def _import_all(path, stats):
+    total = 0
+    for ids, ears, thresholds in import_audiograms(path, stats=stats):
+        total += len(ids)
+    return total
+
+def benchmark(n_records=100000):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "export.csv")
+        _write_csv(path, n_records, rng)
+        size = os.path.getsize(path)
+
+        stats = ImportStats()
+        t0 = time.perf_counter()
+        _import_all(path, stats)
+        elapsed = time.perf_counter() - t0
+
+        # Peak memory, in a second pass (tracing slows the import down).
+        tracemalloc.start()
+        _import_all(path, ImportStats())
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    print(f"{size / 1e6:.1f}MB in {elapsed:.2f}s"
+        f" ({size / 1e6 / elapsed:.1f}MB/s), {stats},"
+        f" peak traced memory {peak / 1e6:.2f}MB")
+    print(f"first error: {stats.errors[0]}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Audiogram importer")
+    parser.add_argument("path", nargs="?",
+        help="Export to import (benchmark if omitted)")
+    parser.add_argument("--format", choices=sorted(READERS), default=None)
+    args = parser.parse_args()
+    if args.path is None:
+        benchmark()
+        return
+    stats = ImportStats()
+    for ids, ears, thresholds in import_audiograms(args.path, stats=stats,
+            fmt=args.format):
+        pass
+    print(stats)
+    for error in stats.errors:
+        print(f"  {error}")
+
+if __name__ == "__main__":
+    main()
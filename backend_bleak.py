@@ -0,0 +1,64 @@
+import asyncio
+from bleak import BleakClient, BleakScanner
+from bleak.backends.device import BLEDevice
+from bleak.backends.scanner import AdvertisementData
+
+from ble_config import SERVICE_UUID
+from ble_logging import log
+from gatt_client import demo_profile, exchange, push_profile
+from gatt_trace import RecordingClient
+
+# bleak central backend (macOS, Linux, Windows).
+
+# Client side code (updated with more debugging)
+def device_found(device: BLEDevice, advertisement_data: AdvertisementData):
+    # Formatting happens on the log's writer thread, not in the scanner callback.
+    log.event("adv", name=device.name, address=device.address,
+        rssi=advertisement_data.rssi, data=advertisement_data)
+    if SERVICE_UUID.lower() in [str(uuid).lower() for uuid in advertisement_data.service_uuids]:
+        log.event("service", name=device.name, address=device.address)
+
+# target: address or BLEDevice
+async def run_ble_client(target, trace=None):
+    client = BleakClient(target)
+    if trace is not None:
+        client = RecordingClient(client, trace)
+    address = getattr(target, "address", target)
+    try:
+        async with client:
+            print(f"Connected to: {address}")
+            await exchange(client)
+            await push_profile(client, demo_profile())
+            await asyncio.sleep(10.0)
+    except Exception as e:
+        print(f"Error in client: {e}")
+
+async def client_main(address=None, trace=None):
+    if address is not None:
+        await run_ble_client(address, trace)
+        return
+
+    print("Scanning for Bluetooth devices...")
+    scanner = BleakScanner(
+        detection_callback=device_found,
+        service_uuids=[SERVICE_UUID])
+    await scanner.start()
+    await asyncio.sleep(20.0)
+    await scanner.stop()
+
+    # Only devices advertising our service are reported (service_uuids).
+    found = scanner.discovered_devices_and_advertisement_data.values()
+    if not found:
+        print("No devices found. Make sure the server is running and advertising.")
+        return
+    found = sorted(found, key=lambda item: item[1].rssi, reverse=True)
+    for i, (device, advertisement_data) in enumerate(found):
+        print(f"Device {i}: {device.name}"
+            f" // rssi={advertisement_data.rssi} ({device.address})")
+
+    device = found[0][0]
+    print(f"Connecting to nearest device: {device.name} ({device.address})")
+    await run_ble_client(device, trace)
+
+def run(args):
+    asyncio.run(client_main(args.address, args.trace))
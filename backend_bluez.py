@@ -0,0 +1,110 @@
+import asyncio
+
+from bless import BlessServer, GATTAttributePermissions, \
+    GATTCharacteristicProperties
+
+from ble_config import SERVICE_UUID, CHARACTERISTIC_UUID
+from ble_logging import log
+from command_protocol import is_frame
+from gatt_server import MultiCentralServer
+from gatt_trace import OP_READ, OP_READ_RESPONSE, OP_WRITE, \
+    OP_WRITE_NO_RESPONSE, OP_NOTIFY
+from profile_sync import DIGEST_CHARACTERISTIC_UUID
+
+# BlueZ peripheral backend (Linux): a D-Bus GATT application and
+# advertisement registered with bluetoothd through bless.
+#
+# bless does not say which central a request comes from, and a value
+# update is notified to every subscribed central, so all centrals share
+# one session (message, command queue, notification batch) here. Command
+# responses carry their sequence ids, so a central ignores the frames of
+# the others.
+
+SESSION_ID = "bluez"
+
+class BlueZServer(object):
+    def __init__(self, loop, trace=None, name="Linux BLE Server"):
+        self.trace = trace # gatt_trace.TraceWriter when recording
+        self.server = MultiCentralServer(schedule=loop.call_soon)
+        self.profile = self.server.profile
+        self.bless = BlessServer(name=name, loop=loop)
+        self.bless.read_request_func = self.on_read
+        self.bless.write_request_func = self.on_write
+        self.session = self.server.session(SESSION_ID, self.send)
+        # bluetoothd only notifies subscribed centrals, so frames are
+        # always handed over.
+        self.session.subscribed = True
+
+    def record(self, op, uuid, payload=b""):
+        if self.trace is not None:
+            self.trace.record(op, uuid, payload)
+
+    def send(self, data):
+        characteristic = self.bless.get_characteristic(CHARACTERISTIC_UUID)
+        characteristic.value = bytearray(data)
+        if not self.bless.update_value(SERVICE_UUID, CHARACTERISTIC_UUID):
+            return False
+        self.record(OP_NOTIFY, CHARACTERISTIC_UUID, data)
+        return True
+
+    async def start(self):
+        await self.bless.add_new_service(SERVICE_UUID)
+        await self.bless.add_new_characteristic(SERVICE_UUID,
+            CHARACTERISTIC_UUID,
+            GATTCharacteristicProperties.read
+                | GATTCharacteristicProperties.write
+                | GATTCharacteristicProperties.write_without_response
+                | GATTCharacteristicProperties.notify,
+            None,
+            GATTAttributePermissions.readable
+                | GATTAttributePermissions.writeable)
+        await self.bless.add_new_characteristic(SERVICE_UUID,
+            DIGEST_CHARACTERISTIC_UUID, GATTCharacteristicProperties.read,
+            None, GATTAttributePermissions.readable)
+        await self.bless.start()
+        print(f"Added service: {SERVICE_UUID}")
+        print(f"Added characteristic: {CHARACTERISTIC_UUID}")
+        print(f"Added characteristic: {DIGEST_CHARACTERISTIC_UUID}")
+        print(f"Started advertising with UUID: {SERVICE_UUID}")
+
+    async def stop(self):
+        await self.bless.stop()
+
+    # bless callbacks, called on the event loop by the D-Bus handlers.
+
+    def on_read(self, characteristic, **kwargs):
+        uuid = str(characteristic.uuid).lower()
+        value = self.server.read(self.session, uuid)
+        self.record(OP_READ, uuid)
+        self.record(OP_READ_RESPONSE, uuid, value)
+        log.event("read", central=SESSION_ID, uuid=uuid)
+        return bytearray(value)
+
+    def on_write(self, characteristic, value, **kwargs):
+        uuid = str(characteristic.uuid).lower()
+        if uuid != CHARACTERISTIC_UUID:
+            return
+        data = bytes(value)
+        if is_frame(data):
+            # Pipelined command: the response goes out as a notification.
+            self.record(OP_WRITE_NO_RESPONSE, uuid, data)
+            self.server.write(self.session, data)
+            return
+        self.record(OP_WRITE, uuid, data)
+        self.server.write(self.session, data)
+        log.event("write", central=SESSION_ID, value=self.session.message)
+
+async def server_main(trace=None):
+    server = BlueZServer(asyncio.get_running_loop(), trace)
+    await server.start()
+    print("Server started. Press Ctrl+C to stop.")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+def run(args):
+    try:
+        asyncio.run(server_main(args.trace))
+    except KeyboardInterrupt:
+        print("Server stopped.")
@@ -0,0 +1,163 @@
+from PyObjCTools import AppHelper
+from Foundation import *
+from CoreBluetooth import *
+import objc
+
+from ble_config import SERVICE_UUID, CHARACTERISTIC_UUID
+from ble_logging import log
+from command_protocol import is_frame
+from gatt_server import MultiCentralServer
+from gatt_trace import OP_READ, OP_READ_RESPONSE, OP_WRITE, \
+    OP_WRITE_NO_RESPONSE, OP_NOTIFY
+from profile_sync import DIGEST_CHARACTERISTIC_UUID
+
+# CoreBluetooth peripheral backend (macOS, PyObjC).
+
+# Server side code (updated with more debugging)
+class BluetoothServerDelegate(NSObject):
+    def init(self):
+        self = objc.super(BluetoothServerDelegate, self).init()
+        if self is None: return None
+        # One session (message, command queue, notification batch) per
+        # central; command frames are drained on the next run loop pass.
+        self.server = MultiCentralServer(
+            schedule=lambda fn: AppHelper.callLater(0, fn))
+        self.profile = self.server.profile
+        self.trace = None # gatt_trace.TraceWriter when recording
+        return self
+
+    def session_for(self, central):
+        identifier = central.identifier().UUIDString()
+
+        def send(data):
+            value = NSData.dataWithBytes_length_(data, len(data))
+            if not self.manager.updateValue_forCharacteristic_onSubscribedCentrals_(
+                    value, self.characteristic, [central]):
+                # Transmit queue is full; retried when the manager is ready.
+                return False
+            self.record(OP_NOTIFY, CHARACTERISTIC_UUID, data)
+            return True
+
+        return self.server.session(identifier, send)
+
+    def record(self, op, uuid, payload=b""):
+        if self.trace is not None:
+            self.trace.record(op, uuid, payload)
+
+    def start_advertising(self):
+        manager = CBPeripheralManager.alloc().initWithDelegate_queue_(self, None)
+        self.manager = manager
+
+    def peripheralManagerDidUpdateState_(self, peripheral):
+        states = ['Unknown', 'Resetting', 'Unsupported', 'Unauthorized', 'PoweredOff', 'PoweredOn']
+        print(f"Bluetooth state changed: {states[peripheral.state()]}")
+        if peripheral.state() == CBManagerStatePoweredOn:
+            print("Bluetooth is powered on")
+            self.add_services()
+        else:
+            print("Bluetooth is not ready. Please check your Bluetooth settings.")
+
+    def add_services(self):
+        service = CBMutableService.alloc().initWithType_primary_(
+            CBUUID.UUIDWithString_(SERVICE_UUID), True
+        )
+        characteristic = CBMutableCharacteristic.alloc().initWithType_properties_value_permissions_(
+            CBUUID.UUIDWithString_(CHARACTERISTIC_UUID),
+            CBCharacteristicPropertyRead | CBCharacteristicPropertyWrite
+                | CBCharacteristicPropertyWriteWithoutResponse | CBCharacteristicPropertyNotify,
+            None,
+            CBAttributePermissionsReadable | CBAttributePermissionsWriteable
+        )
+        digest_characteristic = CBMutableCharacteristic.alloc().initWithType_properties_value_permissions_(
+            CBUUID.UUIDWithString_(DIGEST_CHARACTERISTIC_UUID),
+            CBCharacteristicPropertyRead,
+            None,
+            CBAttributePermissionsReadable
+        )
+        service.setCharacteristics_([characteristic, digest_characteristic])
+        self.manager.addService_(service)
+        self.characteristic = characteristic
+        self.digest_characteristic = digest_characteristic
+        print(f"Added service: {SERVICE_UUID}")
+        print(f"Added characteristic: {CHARACTERISTIC_UUID}")
+        print(f"Added characteristic: {DIGEST_CHARACTERISTIC_UUID}")
+
+    def peripheralManager_didAddService_error_(self, peripheral, service, error):
+        if error:
+            print(f"Error adding service: {error}")
+        else:
+            print("Service added successfully")
+            self.manager.startAdvertising_({
+                CBAdvertisementDataServiceUUIDsKey: [CBUUID.UUIDWithString_(SERVICE_UUID)],
+                CBAdvertisementDataLocalNameKey: "MacBook BLE Server"
+            })
+            print(f"Started advertising with UUID: {SERVICE_UUID}")
+
+    def peripheralManagerDidStartAdvertising_error_(self, peripheral, error):
+        if error:
+            print(f"Error advertising: {error}")
+        else:
+            print("Advertising started successfully")
+
+    def peripheralManager_didReceiveReadRequest_(self, peripheral, request):
+        uuid = request.characteristic().UUID()
+        if uuid == CBUUID.UUIDWithString_(CHARACTERISTIC_UUID):
+            uuid = CHARACTERISTIC_UUID
+        elif uuid == CBUUID.UUIDWithString_(DIGEST_CHARACTERISTIC_UUID):
+            uuid = DIGEST_CHARACTERISTIC_UUID
+        else:
+            return
+        session = self.session_for(request.central())
+        value = self.server.read(session, uuid)
+        request.setValue_(value)
+        peripheral.respondToRequest_withResult_(request, CBATTErrorSuccess)
+        self.record(OP_READ, uuid)
+        self.record(OP_READ_RESPONSE, uuid, value)
+        log.event("read", central=session.identifier, uuid=uuid)
+
+    def peripheralManager_didReceiveWriteRequests_(self, peripheral, requests):
+        for request in requests:
+            if request.characteristic().UUID() == CBUUID.UUIDWithString_(CHARACTERISTIC_UUID):
+                session = self.session_for(request.central())
+                data = request.value().bytes().tobytes()
+                if is_frame(data):
+                    # Pipelined command: the response goes out as a notification.
+                    self.record(OP_WRITE_NO_RESPONSE, CHARACTERISTIC_UUID, data)
+                    self.server.write(session, data)
+                    continue
+                self.record(OP_WRITE, CHARACTERISTIC_UUID, data)
+                self.server.write(session, data)
+                log.event("write", central=session.identifier,
+                    value=session.message)
+        peripheral.respondToRequest_withResult_(requests[0], CBATTErrorSuccess)
+
+    def peripheralManager_central_didSubscribeToCharacteristic_(self,
+            peripheral, central, characteristic):
+        session = self.session_for(central)
+        session.subscribed = True
+        self.server.flush(session)
+        log.event("subscribe", central=session.identifier)
+
+    def peripheralManager_central_didUnsubscribeFromCharacteristic_(self,
+            peripheral, central, characteristic):
+        # CoreBluetooth has no disconnect callback for peripherals; losing
+        # the subscription is the closest signal.
+        identifier = central.identifier().UUIDString()
+        self.server.remove_session(identifier)
+        log.event("unsubscribe", central=identifier)
+
+    def peripheralManagerIsReadyToUpdateSubscribers_(self, peripheral):
+        self.server.flush_all()
+
+def run_server(trace=None):
+    delegate = BluetoothServerDelegate.alloc().init()
+    delegate.trace = trace
+    delegate.start_advertising()
+    print("Server started. Press Ctrl+C to stop.")
+    try:
+        AppHelper.runConsoleEventLoop()
+    except KeyboardInterrupt:
+        print("Server stopped.")
+
+def run(args):
+    run_server(args.trace)
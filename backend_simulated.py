@@ -0,0 +1,70 @@
+import asyncio
+
+from ble_config import NUM_BANDS
+from command_protocol import CommandServer, PipelinedClient
+from gatt_client import demo_profile, exchange, push_profile
+from gatt_server import MultiCentralServer
+from gatt_trace import RecordingClient, RecordingServer
+from profile_sync import ProfileStore
+from sim_link import SimulatedLink
+
+# Simulated backend: client and server run in-process over a SimulatedLink,
+# no radio or platform Bluetooth stack needed.
+def make_server():
+    server = CommandServer("Hello from Mac Server!")
+    ProfileStore(NUM_BANDS).attach(server)
+    return server
+
+async def client_main(interval=0.0075, trace=None):
+    async with SimulatedLink(make_server(), interval) as link:
+        print(f"Connected to: {link.identifier} (simulated)")
+        client = link if trace is None else RecordingClient(link, trace)
+        await exchange(client)
+        await push_profile(client, demo_profile())
+
+# Serves a MultiCentralServer to `n_centrals` simulated centrals, each
+# doing the demo exchange and then a ping per second, and prints the
+# per-session counters until stopped. With a trace, the server side of the
+# traffic is recorded.
+async def server_main(interval=0.0075, trace=None, n_centrals=2,
+        report_interval=5.0):
+    loop = asyncio.get_running_loop()
+    server = MultiCentralServer(schedule=loop.call_soon)
+    served = server if trace is None else RecordingServer(server, trace)
+    print(f"Server started (simulated, {n_centrals} centrals)."
+        " Press Ctrl+C to stop.")
+
+    async def central(i):
+        async with SimulatedLink(served, interval,
+                identifier=f"central-{i}") as link:
+            await exchange(link, f"Hello from central-{i}")
+            commands = PipelinedClient(link)
+            await commands.start()
+            try:
+                while True:
+                    await commands.ping(b"ping")
+                    await asyncio.sleep(1.0)
+            finally:
+                await commands.stop()
+
+    tasks = [asyncio.ensure_future(central(i)) for i in range(n_centrals)]
+    try:
+        while True:
+            await asyncio.sleep(report_interval)
+            for session in server.sessions.values():
+                print(f"{session.identifier}: {session.requests} requests,"
+                    f" {session.notifications} notifications,"
+                    f" message={session.message!r}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def run(args):
+    if args.mode == "server":
+        try:
+            asyncio.run(server_main(trace=args.trace))
+        except KeyboardInterrupt:
+            print("Server stopped.")
+        return
+    asyncio.run(client_main(trace=args.trace))
@@ -0,0 +1,68 @@
+import importlib
+import os
+import sys
+
+# Registry of BLE backends. Backends are only imported when selected, so
+# e.g. the bleak client never pays for PyObjC and the CoreBluetooth server
+# is never imported on Linux. Each backend module provides run(args).
+BACKENDS = {}
+
+def register(name, module, modes, description):
+    BACKENDS[name] = (module, modes, description)
+
+register("corebluetooth", "backend_corebluetooth", ["server"],
+    "CoreBluetooth peripheral (macOS, PyObjC)")
+register("bluez", "backend_bluez", ["server"],
+    "BlueZ peripheral (Linux, D-Bus GATT via bless)")
+register("bleak", "backend_bleak", ["client"],
+    "bleak central (macOS, Linux, Windows)")
+register("simulated", "backend_simulated", ["client", "server"],
+    "In-process simulated link")
+
+def default_backend(mode):
+    if mode == "client":
+        return "bleak"
+    if sys.platform == "darwin":
+        return "corebluetooth"
+    if sys.platform.startswith("linux"):
+        return "bluez"
+    raise ValueError(f"No {mode} backend for {sys.platform};"
+        f" use --backend simulated")
+
+def load(name):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}'."
+            f" Choose from: {', '.join(BACKENDS)}")
+    return importlib.import_module(BACKENDS[name][0])
+
+# Cold-start cost of a backend, from `python -X importtime`. Returns the
+# total import time in microseconds, or None if the backend can't be
+# imported here. Without a name, measures the bare interpreter.
+def measure_importtime(name=None):
+    import re
+    import subprocess
+    code = "pass" if name is None else \
+        f"import backends; backends.load({name!r})"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        return None
+    total = 0
+    pattern = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+    for line in result.stderr.splitlines():
+        match = pattern.match(line)
+        if match and not match.group(3):
+            total += int(match.group(2))
+    return total
+
+def print_importtimes():
+    print(f"{'interpreter':>14}: {measure_importtime() / 1e3:8.1f} ms")
+    for name, (module, modes, description) in BACKENDS.items():
+        total = measure_importtime(name)
+        cost = "unavailable" if total is None else f"{total / 1e3:8.1f} ms"
+        print(f"{name:>14} ({'/'.join(modes)}): {cost}")
+
+def print_backends():
+    for name, (module, modes, description) in BACKENDS.items():
+        print(f"{name:>14} ({'/'.join(modes)}): {description}")
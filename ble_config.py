@@ -0,0 +1,4 @@
+# GATT layout shared by the client and server backends.
+SERVICE_UUID = "12345678-1234-5678-1234-56789abcdef1"
+CHARACTERISTIC_UUID = "87654321-4321-8765-4321-fedcba987654"
+NUM_BANDS = 8 # 250Hz - 8kHz, see ble_controller.py
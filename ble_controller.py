@@ -1,7 +1,8 @@
-import matplotlib.pyplot as plt
 import matplotlib
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
 from functools import partial
+import argparse
 
 import matplotlib as mpl
 mpl.rcParams['figure.dpi'] = 50
@@ -9,31 +10,32 @@ mpl.rcParams['figure.dpi'] = 50
 import tkinter as tk
 import numpy as np
 
-def plot(canvas, ax):
-    ax.clear()
+from fitting_profile import section_index, encode_section, \
+    encode_sections, FREQUENCIES, step_gain
+from autofit import fit_gains
+from sii import IncrementalSII
 
-    # Plot data on Matplotlib Figure
-    t = np.arange(0, 2*np.pi, .01)
-    n = 0.1 * np.random.randn(len(t))
-    ax.plot(t, n + np.sin(t))
-    canvas.draw()
+GAIN_STEP_dB = 1
 
+# The plot_* functions create the artists once and return the lines; edits
+# update them in place with line.set_ydata (see ControllerState.redraw_*)
+# instead of clearing and re-plotting the axes.
 def plot_frequency_graph(ax, marker, color, label,
     freqs, values):
 
-    ax.plot(freqs, values, label=label,
+    line, = ax.plot(freqs, values, label=label,
         color=color, marker=marker)
     ax.set_xscale('log')
     ax.set_xticks(freqs)
     ax.get_xaxis().set_major_formatter(
         matplotlib.ticker.ScalarFormatter())
-    plt.minorticks_off()
+    ax.minorticks_off()
     ax.grid('on')
 
     ax.set_xlim([freqs[0] * 0.8, 1.2*freqs[-1]])
     # ax.set_xlabel("Frequency [Hz]")
     # ax.set_title(f"Audiogram Thresholds")
-    plt.legend()
+    return line
 
 def plot_audiogram(ax, freqs, audiogram, side):
     if side == 'left':
@@ -42,37 +44,39 @@ def plot_audiogram(ax, freqs, audiogram, side):
     else:
         color = '#ff8684'
         marker = 'o'
-    plot_frequency_graph(ax, marker, color, side,
+    line = plot_frequency_graph(ax, marker, color, side,
         freqs, audiogram)
     ax.set_ylim([0, 80])
     ax.set_ylabel("PTA Threshold [dB]")
-    plt.legend()
+    ax.legend()
+    return line
 
 def plot_frequency_gain(ax, freqs, speech_dB, gains, MPOs, side):
     # Speech
     marker = None
     color = 'green'
     label = f"Moderate Speech ({side})"
-    plot_frequency_graph(ax, marker, color, label,
+    speech_line = plot_frequency_graph(ax, marker, color, label,
         freqs, [speech_dB] * len(freqs))
 
     # Speech + Gain
     marker = 'd'
     color = 'green'
     label = f"Moderate Speech + Gain ({side})"
-    plot_frequency_graph(ax, marker, color, label,
+    gain_line = plot_frequency_graph(ax, marker, color, label,
         freqs, np.array(gains) + speech_dB)
 
     # MPO
     marker = '*'
     color = 'black'
     label = f"MPO ({side})"
-    plot_frequency_graph(ax, marker, color, label,
+    mpo_line = plot_frequency_graph(ax, marker, color, label,
         freqs, MPOs)
 
     ax.set_ylim([30, 120])
     ax.set_ylabel("Volume (dB SPL)")
-    plt.legend()
+    ax.legend()
+    return speech_line, gain_line, mpo_line
 
 class ControllerState(object):
     def __init__(self, axes, canvases, frequencies):
@@ -82,6 +86,10 @@ class ControllerState(object):
         self.left_audiogram = [0] * len(frequencies)
         self.right_audiogram = [0] * len(frequencies)
 
+        # Threshold entry widgets, filled in by load_audiogram.
+        self.left_threshold_texts = []
+        self.right_threshold_texts = []
+
         self.inc_gain_buttons = [0] * len(frequencies)
         self.dec_gain_buttons = [0] * len(frequencies)
 
@@ -109,22 +117,38 @@ class ControllerState(object):
         self.right_moderate_gain_labels = []
         self.right_soft_gain_labels = []
 
-        plot_audiogram(self.axes[0][0], self.frequencies,
-            self.left_audiogram, 'left')
-        plot_audiogram(self.axes[0][1], self.frequencies,
-            self.right_audiogram, 'right')
-
-        plot_frequency_gain(self.axes[1][0], self.frequencies,
-            self.default_moderate_dB,
-            self.left_moderate_gains,
-            self.left_mpos, 'left')
-        plot_frequency_gain(self.axes[1][1], self.frequencies,
-            self.default_moderate_dB,
-            self.right_moderate_gains,
-            self.right_mpos, 'right')
+        self.audiogram_lines = [
+            plot_audiogram(self.axes[0][0], self.frequencies,
+                self.left_audiogram, 'left'),
+            plot_audiogram(self.axes[0][1], self.frequencies,
+                self.right_audiogram, 'right')]
+
+        # (speech, speech + gain, MPO) lines per side
+        self.gain_lines = [
+            plot_frequency_gain(self.axes[1][0], self.frequencies,
+                self.default_moderate_dB,
+                self.left_moderate_gains,
+                self.left_mpos, 'left'),
+            plot_frequency_gain(self.axes[1][1], self.frequencies,
+                self.default_moderate_dB,
+                self.right_moderate_gains,
+                self.right_mpos, 'right')]
 
         self.status_label = None
 
+        # LatestValuePushQueue for the connected device (see live_tuning.py),
+        # None while not connected.
+        self.push_queue = None
+
+        # Rerun auto_fit on every threshold edit.
+        self.auto_fit_live = False
+
+        # SII of moderate speech per side, shown in the gain plot titles.
+        self.sii = {side: IncrementalSII(self.frequencies,
+            self.default_moderate_dB) for side in ['left', 'right']}
+        for side in self.sii:
+            self.update_sii(side)
+
     def report_info(self, msg):
         self.status_label["text"] = f"Status: {msg}"
         self.status_label["fg"] = "black"
@@ -140,6 +164,32 @@ class ControllerState(object):
     def bluetooth_connect(self):
         self.report_info("Connecting to Bluetooth...")
 
+    def redraw_audiogram(self, side):
+        j = 0 if side == 'left' else 1
+        self.audiogram_lines[j].set_ydata(getattr(self, f"{side}_audiogram"))
+        self.canvases[0][j].draw_idle()
+
+    def redraw_gain(self, side):
+        j = 0 if side == 'left' else 1
+        _, gain_line, mpo_line = self.gain_lines[j]
+        gain_line.set_ydata([gain + self.default_moderate_dB
+            for gain in getattr(self, f"{side}_moderate_gains")])
+        mpo_line.set_ydata(getattr(self, f"{side}_mpos"))
+        self.canvases[1][j].draw_idle()
+
+    # Updates the SII for the edited bands (all if None).
+    def update_sii(self, side, bands=None):
+        audiogram = getattr(self, f"{side}_audiogram")
+        gains = getattr(self, f"{side}_moderate_gains")
+        if bands is None:
+            value = self.sii[side].reset(audiogram, gains)
+        else:
+            for i in bands:
+                value = self.sii[side].update(i, audiogram[i], gains[i])
+        j = 0 if side == 'left' else 1
+        self.axes[1][j].set_title(f"SII: {value:.2f}")
+        self.canvases[1][j].draw_idle()
+
     def update_threshold(self, side, freq_i, event):
         x = event.widget.get("1.0", "end-1c")
         if x == "":
@@ -158,20 +208,67 @@ class ControllerState(object):
             self.report_error(f"Threshold out of accepted range.")
             return
 
-        j = 0 if side == 'left' else 1
-        ax = self.axes[0][j]
-        canvas = self.canvases[0][j]
-
-        ax.clear()
-
         if side == 'left':
             self.left_audiogram[freq_i] = new_threshold_dB
-            plot_audiogram(ax, self.frequencies, self.left_audiogram, side)
         else:
             self.right_audiogram[freq_i] = new_threshold_dB
-            plot_audiogram(ax, self.frequencies, self.right_audiogram, side)
-        canvas.draw()
-        plt.legend()
+        self.redraw_audiogram(side)
+        self.push_sections(side, ["audiogram"])
+        if self.auto_fit_live:
+            self.auto_fit([side])
+        else:
+            self.update_sii(side, [freq_i])
+
+    # Loads thresholds for one or both sides, e.g. a record from
+    # audiogram_import.find_audiogram. Bands that are NaN or outside
+    # 0..80 dB are left unchanged.
+    def load_audiogram(self, thresholds):
+        for side, values in thresholds.items():
+            audiogram = getattr(self, f"{side}_audiogram")
+            texts = getattr(self, f"{side}_threshold_texts")
+            for i, value in enumerate(values):
+                if not 0 <= value <= 80: # Also false for NaN
+                    continue
+                audiogram[i] = int(round(value))
+                if i < len(texts):
+                    texts[i].delete("1.0", "end")
+                    texts[i].insert("1.0", str(audiogram[i]))
+                    texts[i].tag_add("center", "1.0", "end")
+            self.redraw_audiogram(side)
+            self.push_sections(side, ["audiogram"])
+            if self.auto_fit_live:
+                self.auto_fit([side])
+            else:
+                self.update_sii(side)
+
+    # Loads a record (the first one if record_id is None) from a clinic
+    # export, see audiogram_import.py.
+    def load_audiogram_file(self, path, record_id=None):
+        from audiogram_import import find_audiogram
+        try:
+            thresholds = find_audiogram(path, record_id, self.frequencies)
+        except (OSError, ValueError) as e:
+            self.report_error(f"Could not load {path}: {e}")
+            return
+        if not thresholds:
+            self.report_error(f"No audiogram found in {path}.")
+            return
+        self.load_audiogram(thresholds)
+        self.report_info(f"Loaded audiogram from {path}.")
+
+    def load_audiogram_dialog(self):
+        from audiogram_import import READERS
+        from tkinter import filedialog, simpledialog
+        patterns = " ".join(f"*{ext}" for ext in READERS)
+        path = filedialog.askopenfilename(title="Load Audiogram",
+            filetypes=[("Audiogram exports", patterns), ("All files", "*")])
+        if not path:
+            return
+        record_id = simpledialog.askstring("Load Audiogram",
+            "Record id (empty for the first record):")
+        if record_id is None:
+            return
+        self.load_audiogram_file(path, record_id.strip() or None)
 
     def copy_gain_to_labels(self):
         for i in range(len(self.frequencies)):
@@ -184,7 +281,7 @@ class ControllerState(object):
                 str(self.left_loud_gains[i]))
 
         for i in range(len(self.frequencies)):
-            self.right_mpo_labels[i]["text"] = str(self.left_mpos[i])
+            self.right_mpo_labels[i]["text"] = str(self.right_mpos[i])
             self.right_soft_gain_labels[i]["text"] = (
                 str(self.right_soft_gains[i]))
             self.right_moderate_gain_labels[i]["text"] = (
@@ -201,13 +298,8 @@ class ControllerState(object):
             self.left_loud_gains[i] = (
                 int(0.3 * self.left_audiogram[i]))
 
-        self.axes[1][0].clear()
-        plot_frequency_gain(self.axes[1][0],
-            self.frequencies,
-            self.default_moderate_dB,
-            self.left_moderate_gains,
-            self.left_mpos, 'left')
-        self.canvases[1][0].draw()
+        self.redraw_gain('left')
+        self.update_sii('left')
 
         for i in range(len(self.frequencies)):
             self.right_mpos[i] = 90 + (i % 2)
@@ -217,24 +309,85 @@ class ControllerState(object):
             self.right_loud_gains[i] = (
                 int(0.3 * self.right_audiogram[i]))
 
-        self.axes[1][1].clear()
-        plot_frequency_gain(self.axes[1][1],
-            self.frequencies,
-            self.default_moderate_dB,
-            self.right_moderate_gains,
-            self.right_mpos, 'right')
-        self.canvases[1][1].draw()
+        self.redraw_gain('right')
+        self.update_sii('right')
 
         self.copy_gain_to_labels()
+        for side in ['left', 'right']:
+            self.push_sections(side, ["soft_gains", "moderate_gains",
+                "loud_gains", "mpos"])
+
+    def set_auto_fit_live(self, enabled):
+        self.auto_fit_live = enabled
+        if enabled:
+            self.auto_fit()
+
+    # Solves the moderate gains for the NAL-R target under the MPO and
+    # slope limits (see autofit.py). Soft and loud gains move with them,
+    # keeping their offsets from the moderate gain.
+    def auto_fit(self, sides=("left", "right")):
+        audiograms = [getattr(self, f"{side}_audiogram") for side in sides]
+        mpos = [getattr(self, f"{side}_mpos") for side in sides]
+        fitted = fit_gains(audiograms, mpos, self.default_moderate_dB,
+            self.frequencies, integer=True)
+
+        for side, gains in zip(sides, fitted.astype(int).tolist()):
+            moderate = list(getattr(self, f"{side}_moderate_gains"))
+            changed = []
+            for field in ["soft_gains", "moderate_gains", "loud_gains"]:
+                values = getattr(self, f"{side}_{field}")
+                new_values = [step_gain(v, g - m)
+                    for v, g, m in zip(values, gains, moderate)]
+                if new_values != values:
+                    changed.append(field)
+                    values[:] = new_values
+            self.push_sections(side, changed)
+            self.redraw_gain(side)
+            self.update_sii(side)
+        self.copy_gain_to_labels()
 
     def gain_up(self, side, freq_i):
-        assert freq_i >= 0
-        frequency = self.frequencies[freq_i]
+        self.adjust_gain(side, freq_i, GAIN_STEP_dB)
 
     def gain_down(self, side, freq_i):
+        self.adjust_gain(side, freq_i, -GAIN_STEP_dB)
+
+    def adjust_gain(self, side, freq_i, step):
         assert freq_i >= 0
         frequency = self.frequencies[freq_i]
 
+        changed = []
+        for field in ["soft_gains", "moderate_gains", "loud_gains"]:
+            gains = getattr(self, f"{side}_{field}")
+            new_gain = step_gain(gains[freq_i], step)
+            if new_gain != gains[freq_i]:
+                gains[freq_i] = new_gain
+                changed.append(field)
+        if not changed:
+            self.report_error(f"Gain limit reached at {frequency} Hz ({side}).")
+            return
+
+        # Push before redrawing so the device hears the change first.
+        self.push_sections(side, changed)
+
+        getattr(self, f"{side}_soft_gain_labels")[freq_i]["text"] = (
+            str(getattr(self, f"{side}_soft_gains")[freq_i]))
+        getattr(self, f"{side}_moderate_gain_labels")[freq_i]["text"] = (
+            str(getattr(self, f"{side}_moderate_gains")[freq_i]))
+        getattr(self, f"{side}_loud_gain_labels")[freq_i]["text"] = (
+            str(getattr(self, f"{side}_loud_gains")[freq_i]))
+
+        self.redraw_gain(side)
+        self.update_sii(side, [freq_i])
+        self.clear_status()
+
+    def push_sections(self, side, fields):
+        if self.push_queue is None:
+            return
+        for field in fields:
+            self.push_queue.submit(section_index(side, field),
+                encode_section(field, getattr(self, f"{side}_{field}")))
+
 def make_text_impl(root, borderwidth, relief, height,
         width=-1, bg="x", font="x"):
     return tk.Text(root, borderwidth=borderwidth, relief=relief,
@@ -256,7 +409,35 @@ def focus_next_widget(event):
 ############
 ### MAIN ###
 ############
+def poll_telemetry(root, controller_state, shared, process, connected=None):
+    if not process.is_alive():
+        controller_state.report_error("BLE process exited; changes are not"
+            " sent to the device.")
+        return
+    telemetry = shared.read_telemetry()
+    if telemetry["connected"] != connected:
+        connected = telemetry["connected"]
+        if connected:
+            controller_state.report_info("Connected (BLE process).")
+        else:
+            controller_state.report_info("Disconnected (BLE process).")
+    root.after(500, poll_telemetry, root, controller_state, shared, process,
+        connected)
+
 def main():
+    parser = argparse.ArgumentParser(description="CAM2 Fitting Software")
+    parser.add_argument("--two-process", action="store_true",
+        help="Run BLE I/O in a separate process, sharing the profile"
+        " through shared memory")
+    parser.add_argument("--address", default=None,
+        help="Device address for --two-process (simulated link if omitted)")
+    parser.add_argument("--audiogram", default=None,
+        help="Clinic export (CSV, JSON Lines or XML) to load thresholds"
+        " from")
+    parser.add_argument("--record", default=None,
+        help="Record id to load from --audiogram (first record if omitted)")
+    args = parser.parse_args()
+
     num_rows = 39 + 1
     num_cols = 26 + 1
     # boot.title("Acceptable Noise Level (ANL) Test")
@@ -264,7 +445,7 @@ def main():
     root = tk.Tk()
     root.title("CAM2 Fitting Software")
     width = 5
-    frequencies = [250, 500, 1000, 2000, 3000, 4000, 6000, 8000]
+    frequencies = list(FREQUENCIES)
     freq_labels = [250, 500, "1k", "2k", "3k", "4k", "6k", "8k"]
 
     panel = tk.Label(root, text="CAM2 Fitting Software")
@@ -297,7 +478,10 @@ def main():
     fig_objs = [[], []]
     for i in range(2):
         for j in range(2):
-            fig, ax = plt.subplots(figsize=(5, 3.2))
+            # Not plt.subplots: pyplot's figure manager would keep a
+            # global reference to every figure.
+            fig = Figure(figsize=(5, 3.2))
+            ax = fig.add_subplot()
             canvas = FigureCanvasTkAgg(fig, master=root)
 
             axes[i].append(ax)
@@ -445,6 +629,7 @@ def main():
                         # obj.insert("1.0", "0")
                         obj.tag_add("center", "1.0", "end")
                         side = 'left'
+                        controller_state.left_threshold_texts.append(obj)
                         update_threshold_p = partial(
                             controller_state.update_threshold, side, c-offset)
                         obj.bind('<KeyRelease>', update_threshold_p)
@@ -467,6 +652,7 @@ def main():
                         # obj.insert("1.0", "0")
                         obj.tag_add("center", "1.0", "end")
                         side = 'right'
+                        controller_state.right_threshold_texts.append(obj)
                         update_threshold_p = partial(
                             controller_state.update_threshold, side, c-offset)
                         obj.bind('<KeyRelease>', update_threshold_p)
@@ -547,6 +733,18 @@ def main():
                         obj = make_label(width=width,
                             text="0", bg=ia_grey, font=default_font)
                         controller_state.left_loud_gain_labels.append(obj)
+                    elif c <= 12:
+                        auto_fit_var = tk.BooleanVar(root, False)
+                        auto_fit_p = lambda: (
+                            controller_state.set_auto_fit_live(
+                                auto_fit_var.get()))
+                        columnspan = header_columnspan
+                        obj = tk.Checkbutton(root, width=header_width,
+                            text="Auto Fit", variable=auto_fit_var,
+                            bg=ia_black, font=bold_font,
+                            command=auto_fit_p)
+                    elif c <= 12-1+header_columnspan:
+                        obj = None # Don't overwrite the Auto Fit button
                     elif c == 15:
                         obj = make_label( width=header_width,
                             text="Loud", bg=ia_light, font=bold_font)
@@ -570,6 +768,16 @@ def main():
                         obj = make_label(width=width,
                             text="0", bg=ia_grey, font=default_font)
                         controller_state.left_moderate_gain_labels.append(obj)
+                    elif c <= 12:
+                        load_audiogram_p = partial(
+                            controller_state.load_audiogram_dialog)
+                        columnspan = header_columnspan
+                        obj = tk.Button(root, width=header_width,
+                            text="Load Audiogram",
+                            bg=ia_black, font=bold_font,
+                            command=load_audiogram_p)
+                    elif c <= 12-1+header_columnspan:
+                        obj = None # Don't overwrite the Load button
                     elif c == 15:
                         obj = make_label( width=header_width,
                             text="Moderate", bg=ia_light, font=bold_font)
@@ -676,7 +884,28 @@ def main():
                     columnspan=columnspan, padx=0, pady=0, sticky="nsew")
 
 
-    root.mainloop()
+    if args.audiogram is not None:
+        controller_state.load_audiogram_file(args.audiogram, args.record)
+
+    ble_process = None
+    if args.two_process:
+        from shared_profile import SharedPushQueue, start_ble_process, \
+            stop_ble_process
+        # The shared block starts out with the whole current profile;
+        # every later change goes through push_sections.
+        ble_process = start_ble_process(len(frequencies), args.address,
+            sections=encode_sections(controller_state))
+        shared, conn, process = ble_process
+        controller_state.push_queue = SharedPushQueue(shared, conn, process,
+            lambda: controller_state.report_error("BLE process exited;"
+                " changes are not sent to the device."))
+        poll_telemetry(root, controller_state, shared, process)
+
+    try:
+        root.mainloop()
+    finally:
+        if ble_process is not None:
+            stop_ble_process(*ble_process)
 
 if __name__ == "__main__":
     main()
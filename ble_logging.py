@@ -0,0 +1,180 @@
+import json
+import sys
+import threading
+import time
+from collections import deque
+
+# Queue-based event log for BLE callbacks.
+#
+# event() only checks the rate limit / sampling for its kind and appends a
+# (timestamp, kind, fields) tuple to a deque. Formatting (including str() of
+# device and advertisement objects) and writing happen on a background
+# thread, so callbacks never block on the terminal.
+class EventLog(object):
+    def __init__(self, stream=None, fmt="text", max_queue=10000,
+            flush_interval=0.05, rate_limits=None, sample_every=None):
+        self.stream = stream
+        self.fmt = fmt
+        self.flush_interval = flush_interval
+        self.records = deque(maxlen=max_queue)
+        self.enabled = True
+
+        # kind -> events per second (token bucket, burst of one second).
+        self.rate_limits = dict(rate_limits or {})
+        self._tokens = {k: float(v) for k, v in self.rate_limits.items()}
+        self._last_refill = {}
+        # kind -> keep one event out of every N.
+        self.sample_every = dict(sample_every or {})
+        self._seen = {}
+
+        self.dropped = 0
+        self.suppressed = 0
+        self._wake = threading.Event()
+        self._thread = None
+        self._running = False
+
+    def event(self, kind, **fields):
+        if not self.enabled:
+            return
+
+        n = self.sample_every.get(kind)
+        if n is not None:
+            seen = self._seen.get(kind, 0)
+            self._seen[kind] = seen + 1
+            if seen % n:
+                self.suppressed += 1
+                return
+
+        rate = self.rate_limits.get(kind)
+        if rate is not None:
+            now = time.monotonic()
+            last = self._last_refill.get(kind, now)
+            self._last_refill[kind] = now
+            tokens = min(float(rate), self._tokens[kind] + (now - last) * rate)
+            if tokens < 1.0:
+                self._tokens[kind] = tokens
+                self.suppressed += 1
+                return
+            self._tokens[kind] = tokens - 1.0
+
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append((time.time(), kind, fields))
+
+    def format(self, record):
+        t, kind, fields = record
+        if self.fmt == "json":
+            out = {"t": round(t, 6), "kind": kind}
+            for k, v in fields.items():
+                out[k] = v if isinstance(v, (int, float, bool, type(None))) \
+                    else str(v)
+            return json.dumps(out)
+        stamp = time.strftime("%H:%M:%S", time.localtime(t))
+        text = " ".join(f"{k}={v}" for k, v in fields.items())
+        return f"{stamp}.{int(t % 1 * 1000):03d} [{kind}] {text}"
+
+    def flush(self):
+        stream = self.stream if self.stream is not None else sys.stdout
+        lines = []
+        while True:
+            try:
+                lines.append(self.format(self.records.popleft()))
+            except IndexError:
+                break
+        if lines:
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run,
+            name="ble-event-log", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        if self.dropped or self.suppressed:
+            stream = self.stream if self.stream is not None else sys.stdout
+            stream.write(f"Event log: {self.suppressed} suppressed,"
+                f" {self.dropped} dropped\n")
+            stream.flush()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+# Shared log for the BLE callbacks. Advertisements are the high frequency
+# event, so they are rate limited per second.
+log = EventLog(rate_limits={"adv": 20})
+
+#################
+### BENCHMARK ###
+#################
+class _FakeDevice(object):
+    def __init__(self, i):
+        self.name = f"Device {i}"
+        self.address = f"AA:BB:CC:DD:EE:{i:02X}"
+        self.rssi = -40 - i
+        self.metadata = {"uuids": ["12345678-1234-5678-1234-56789abcdef1"],
+            "manufacturer_data": {76: bytes(range(23))}}
+
+def _bench_callback(kind, device, stream, event_log):
+    if kind == "print":
+        print(f"Found device: {device.name} ({device.address})", file=stream)
+        print(f"  RSSI: {device.rssi}", file=stream)
+        print(f"  Metadata: {device.metadata}", file=stream)
+    else:
+        event_log.event("adv", name=device.name, address=device.address,
+            rssi=device.rssi, metadata=device.metadata)
+
+# off: logging disabled (enabled = False); print: the old synchronous
+# prints; log: every event enqueued (no rate limit); limited: the shared
+# log's default adv rate limit, i.e. mostly the suppression fast path.
+def benchmark(n=20000):
+    import os
+    devices = [_FakeDevice(i) for i in range(32)]
+    with open(os.devnull, "w") as devnull:
+        results = {}
+        for kind in ["off", "print", "log", "limited"]:
+            rate_limits = {"adv": 20} if kind == "limited" else None
+            event_log = EventLog(stream=devnull, rate_limits=rate_limits,
+                max_queue=n)
+            event_log.enabled = kind != "off"
+            event_log.start()
+            latencies = []
+            for i in range(n):
+                t0 = time.perf_counter()
+                _bench_callback(kind, devices[i % len(devices)], devnull,
+                    event_log)
+                latencies.append(time.perf_counter() - t0)
+            suppressed = event_log.suppressed
+            dropped = event_log.dropped
+            event_log.stop()
+            latencies.sort()
+            results[kind] = latencies
+            print(f"{kind:>7}: mean={sum(latencies) / n * 1e6:7.2f}us"
+                f" p50={latencies[n // 2] * 1e6:7.2f}us"
+                f" p99={latencies[int(n * 0.99)] * 1e6:7.2f}us"
+                f" max={latencies[-1] * 1e6:8.2f}us"
+                f"  suppressed={suppressed} dropped={dropped}")
+    return results
+
+if __name__ == "__main__":
+    benchmark()
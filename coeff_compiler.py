@@ -0,0 +1,254 @@
+import struct
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from fitting_profile import SIDES, FIELDS, FIELD_FORMATS, FREQUENCIES, \
+    encode_sections
+from profile_sync import section_crcs, combine_crcs
+
+# Compiles a fitting profile into the tables the device DSP runs.
+#
+# Per channel, a cascade of one RBJ peaking biquad per band sets the
+# moderate-level frequency response. Neighbouring filters overlap, so the
+# per-filter gains are solved (Newton iterations on the band interaction
+# matrix) for the cascade to hit the moderate gains at the band centres.
+# A compression table per band
+# gives the gain relative to it as a function of input level (soft,
+# moderate and loud gains at the knees, capped so output stays below the
+# MPO). Channel c is fitted with side SIDES[c % len(SIDES)].
+#
+# Blob layout (little endian):
+#
+#   header: magic "CFIT" | version (u8) | channels (u8) | bands (u8)
+#           | coefficient fraction bits (u8) | sample rate (u32)
+#           | profile CRC (u32) | first level (u8) | level step (u8)
+#           | level count (u8) | pad
+#   biquads: channels x bands x (b0, b1, b2, a1, a2), i32 fixed point,
+#            normalized so a0 = 1 (y = b0 x + b1 x1 + b2 x2 - a1 y1 - a2 y2)
+#   compression: channels x bands x levels, i8 gain in dB relative to
+#                the biquad gain
+BLOB_MAGIC = b"CFIT"
+BLOB_VERSION = 1
+BLOB_HEADER = struct.Struct("<4sBBBBIIBBBx")
+
+# Largest value of a single GATT characteristic.
+MAX_ATTRIBUTE_SIZE = 512
+
+# Input levels (dB SPL) at which the soft, moderate and loud gains apply.
+KNEES_dB = [40, 55, 70]
+# Input levels of the compression table.
+LEVELS_dB = list(range(30, 111, 10))
+
+_DTYPES = {"b": np.int8, "B": np.uint8}
+
+# Q of a peaking filter spanning `octaves`.
+def bandwidth_q(octaves):
+    return np.sqrt(2.0 ** octaves) / (2.0 ** octaves - 1)
+
+# RBJ peaking EQ. All arguments broadcast; returns (..., 5) coefficients
+# (b0, b1, b2, a1, a2) normalized by a0.
+def peaking_biquads(center, gain_dB, q, sample_rate):
+    a = 10.0 ** (np.asarray(gain_dB, dtype=float) / 40)
+    w0 = 2 * np.pi * np.asarray(center, dtype=float) / sample_rate
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    a0 = 1 + alpha / a
+    return np.stack(np.broadcast_arrays(
+        (1 + alpha * a) / a0,
+        -2 * cos_w0 / a0,
+        (1 - alpha * a) / a0,
+        -2 * cos_w0 / a0,
+        (1 - alpha / a) / a0), axis=-1)
+
+# Magnitude (dB) of a cascade of biquads (..., bands, 5) at freqs (Hz).
+def cascade_response_dB(coeffs, freqs, sample_rate):
+    z1 = np.exp(-2j * np.pi * np.asarray(freqs, dtype=float) / sample_rate)
+    b0, b1, b2, a1, a2 = [coeffs[..., k, None] for k in range(5)]
+    h = (b0 + b1 * z1 + b2 * z1 ** 2) / (1 + a1 * z1 + a2 * z1 ** 2)
+    return (20 * np.log10(np.abs(h))).sum(axis=-2)
+
+class CoefficientCompiler(object):
+    def __init__(self, sample_rate=32000, channels=2,
+            frequencies=FREQUENCIES, frac_bits=24, cache_size=64,
+            max_size=MAX_ATTRIBUTE_SIZE, tolerance_dB=0.05, iterations=20):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frequencies = np.asarray(frequencies, dtype=float)
+        self.frac_bits = frac_bits
+        self.cache_size = cache_size
+        self.tolerance_dB = tolerance_dB
+        self.iterations = iterations
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        n = len(self.frequencies)
+        self.size = BLOB_HEADER.size + channels * n * (5 * 4 + len(LEVELS_dB))
+        if max_size is not None and self.size > max_size:
+            raise ValueError(f"{channels} channels x {n} bands need"
+                f" {self.size} bytes, more than {max_size}")
+
+        # Bands near or above Nyquist are pulled down to 0.45 fs.
+        self.centers = np.minimum(self.frequencies, 0.45 * sample_rate)
+        # Each band spans the distance to its neighbours (log2 spacing).
+        octaves = np.gradient(np.log2(self.frequencies)) if n > 1 \
+            else np.ones(1)
+        self.q = bandwidth_q(octaves)
+        # Linear interpolation between the knees, flat outside them, as a
+        # (levels x knees) weight matrix.
+        levels = np.asarray(LEVELS_dB, dtype=float)
+        self.weights = np.stack([np.interp(levels, KNEES_dB, row)
+            for row in np.eye(len(KNEES_dB))], axis=1)
+        self.levels = levels
+
+    def _biquads(self, gains):
+        return peaking_biquads(self.centers, gains, self.q, self.sample_rate)
+
+    # Response at the band centres per dB of filter gain, (..., centre,
+    # filter), from each filter at its current gain (secant slope).
+    def _interaction(self, gains):
+        gains = np.where(np.abs(gains) < 1, 1.0, gains)
+        single = cascade_response_dB(self._biquads(gains)[..., None, :],
+            self.centers, self.sample_rate)
+        return np.swapaxes(single / gains[..., None], -1, -2)
+
+    # Filter gains for which the cascade is `target` dB at the band centres.
+    def _band_gains(self, target):
+        gains = np.linalg.solve(self._interaction(np.full_like(target, 10.0)),
+            target[..., None])[..., 0]
+        for _ in range(self.iterations):
+            error = target - cascade_response_dB(self._biquads(gains),
+                self.centers, self.sample_rate)
+            if np.abs(error).max() < self.tolerance_dB:
+                break
+            gains = gains + np.linalg.solve(self._interaction(gains),
+                error[..., None])[..., 0]
+        return gains
+
+    def _side_arrays(self, sections):
+        arrays = {}
+        for i, field in enumerate(FIELDS):
+            arrays[field] = np.stack([np.frombuffer(
+                sections[s * len(FIELDS) + i],
+                dtype=_DTYPES[FIELD_FORMATS[field]])
+                for s in range(len(SIDES))]).astype(float)
+        sides = np.arange(self.channels) % len(SIDES)
+        return {field: values[sides] for field, values in arrays.items()}
+
+    def _compile(self, sections, crc):
+        p = self._side_arrays(sections)
+        moderate = p["moderate_gains"]
+
+        coeffs = self._biquads(self._band_gains(moderate))
+        scaled = np.round(coeffs * (1 << self.frac_bits))
+        limit = 2 ** 31 - 1
+        if np.abs(scaled).max() > limit:
+            raise ValueError(f"Coefficients overflow with"
+                f" {self.frac_bits} fraction bits")
+
+        knees = np.stack([p["soft_gains"] - moderate,
+            np.zeros_like(moderate), p["loud_gains"] - moderate], axis=-1)
+        relative = knees @ self.weights.T
+        # Output (level + moderate + relative) must stay at or below MPO.
+        headroom = p["mpos"][..., None] - self.levels - moderate[..., None]
+        relative = np.floor(np.minimum(relative, headroom))
+        table = np.clip(relative, -128, 127)
+
+        header = BLOB_HEADER.pack(BLOB_MAGIC, BLOB_VERSION, self.channels,
+            len(self.frequencies), self.frac_bits, self.sample_rate, crc,
+            LEVELS_dB[0], LEVELS_dB[1] - LEVELS_dB[0], len(LEVELS_dB))
+        return header + scaled.astype("<i4").tobytes() \
+            + table.astype(np.int8).tobytes()
+
+    # sections: the profile as returned by fitting_profile.encode_sections.
+    def compile(self, sections):
+        # Keyed by the profile bytes themselves (80 bytes), not the CRC: a
+        # CRC collision would return another profile's filters.
+        key = b"".join(sections)
+        blob = self.cache.get(key)
+        if blob is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return blob
+        self.misses += 1
+        blob = self._compile(sections, combine_crcs(section_crcs(sections)))
+        self.cache[key] = blob
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return blob
+
+    def compile_state(self, state):
+        return self.compile(encode_sections(state))
+
+    # Response of the blob's fixed-point cascade at the band centres minus
+    # the moderate gains of the profile it was compiled from, in dB.
+    def centre_error_dB(self, blob, sections):
+        biquads = decode_blob(blob)["biquads"]
+        response = cascade_response_dB(biquads, self.centers,
+            self.sample_rate)
+        return response - self._side_arrays(sections)["moderate_gains"]
+
+def decode_blob(blob):
+    magic, version, channels, bands, frac_bits, sample_rate, crc, \
+        first_level, level_step, n_levels = BLOB_HEADER.unpack_from(blob)
+    if magic != BLOB_MAGIC or version != BLOB_VERSION:
+        raise ValueError(f"Not a version {BLOB_VERSION} coefficient blob")
+    offset = BLOB_HEADER.size
+    n = channels * bands * 5
+    coeffs = np.frombuffer(blob, dtype="<i4", count=n, offset=offset)
+    offset += 4 * n
+    table = np.frombuffer(blob, dtype=np.int8,
+        count=channels * bands * n_levels, offset=offset)
+    return {
+        "sample_rate": sample_rate,
+        "crc": crc,
+        "levels": [first_level + i * level_step for i in range(n_levels)],
+        "biquads": coeffs.reshape(channels, bands, 5) / (1 << frac_bits),
+        "compression": table.reshape(channels, bands, n_levels),
+    }
+
+#################
+### BENCHMARK ###
+#################
+class _Profile(object):
+    def __init__(self, rng, n_bands):
+        for side in SIDES:
+            audiogram = rng.integers(0, 81, n_bands)
+            setattr(self, f"{side}_audiogram", audiogram)
+            setattr(self, f"{side}_soft_gains", audiogram)
+            setattr(self, f"{side}_moderate_gains",
+                (0.6 * audiogram).astype(int))
+            setattr(self, f"{side}_loud_gains",
+                (0.3 * audiogram).astype(int))
+            setattr(self, f"{side}_mpos", 90 + np.arange(n_bands) % 2)
+
+def benchmark(n_profiles=1000):
+    rng = np.random.default_rng(0)
+    compiler = CoefficientCompiler()
+    profiles = [encode_sections(_Profile(rng, len(FREQUENCIES)))
+        for _ in range(n_profiles)]
+
+    t0 = time.perf_counter()
+    for sections in profiles:
+        blob = compiler.compile(sections)
+    cold = (time.perf_counter() - t0) / n_profiles
+    t0 = time.perf_counter()
+    for sections in profiles[-compiler.cache_size:]:
+        compiler.compile(sections)
+    warm = (time.perf_counter() - t0) / compiler.cache_size
+
+    print(f"{len(blob)} byte blob ({compiler.channels} channels,"
+        f" {len(FREQUENCIES)} bands, {compiler.sample_rate} Hz)")
+    print(f"compile: {cold * 1e3:.3f}ms, cached: {warm * 1e6:.1f}us"
+        f" ({compiler.hits} hits, {compiler.misses} misses)")
+    decoded = decode_blob(blob)
+    error = max(np.abs(compiler.centre_error_dB(compiler.compile(sections),
+        sections)).max() for sections in profiles)
+    print(f"max cascade error at the band centres: {error:.3f}dB")
+    print(f"compression levels {decoded['levels']}")
+    print(f"left moderate-level biquads:\n{decoded['biquads'][0]}")
+
+if __name__ == "__main__":
+    benchmark()
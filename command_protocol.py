@@ -0,0 +1,251 @@
+import asyncio
+import struct
+import time
+
+CHARACTERISTIC_UUID = "87654321-4321-8765-4321-fedcba987654"
+
+# Command frames multiplexed over the single read/write/notify
+# characteristic. Requests are written (without response) and responses
+# come back as notifications carrying the same sequence id, so many
+# commands can be in flight and complete out of order.
+#
+#   magic (u8) | seq (u16) | opcode (u8) | status (u8) | payload
+#
+# The magic byte is not a valid UTF-8 lead byte, so frames can share the
+# characteristic with the plain text writes the demo client already does.
+FRAME_MAGIC = 0xA5
+FRAME_HEADER = struct.Struct("<BHBB")
+
+# Several response frames packed into one notification:
+#
+#   batch magic (u8) | (frame length (u16) | frame) repeated
+BATCH_MAGIC = 0xA6
+BATCH_LENGTH = struct.Struct("<H")
+
+OP_PING = 0x01
+OP_READ = 0x02
+OP_WRITE = 0x03
+
+STATUS_OK = 0x00
+STATUS_UNKNOWN_OPCODE = 0x01
+STATUS_ERROR = 0x02
+
+def encode_frame(seq, opcode, payload=b"", status=STATUS_OK):
+    return FRAME_HEADER.pack(FRAME_MAGIC, seq, opcode, status) + payload
+
+def is_frame(data):
+    return len(data) >= FRAME_HEADER.size and data[0] == FRAME_MAGIC
+
+def encode_batch(frames):
+    return bytes([BATCH_MAGIC]) + b"".join(
+        BATCH_LENGTH.pack(len(frame)) + frame for frame in frames)
+
+def decode_batch(data):
+    if not len(data) or data[0] != BATCH_MAGIC:
+        raise ValueError("Not a frame batch")
+    frames = []
+    offset = 1
+    while offset < len(data):
+        if offset + BATCH_LENGTH.size > len(data):
+            raise ValueError(f"Truncated frame length at {offset}")
+        (length,) = BATCH_LENGTH.unpack_from(data, offset)
+        offset += BATCH_LENGTH.size
+        if offset + length > len(data):
+            raise ValueError(f"Truncated frame at {offset}: {length} bytes,"
+                f" {len(data) - offset} left")
+        frames.append(bytes(data[offset:offset + length]))
+        offset += length
+    return frames
+
+def decode_frame(data):
+    magic, seq, opcode, status = FRAME_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC:
+        raise ValueError(f"Bad frame magic: {magic:#x}")
+    return seq, opcode, status, bytes(data[FRAME_HEADER.size:])
+
+class CommandError(Exception):
+    def __init__(self, opcode, status, payload=b""):
+        super().__init__(f"Command {opcode:#04x} failed with status"
+            f" {status:#04x}: {payload!r}")
+        self.opcode = opcode
+        self.status = status
+        self.payload = payload
+
+# Server side
+
+# Dispatches request frames to handlers and builds response frames. Used
+# by BluetoothServerDelegate and, through on_read/on_write, as a simulated
+# GATT server on a SimulatedLink.
+class CommandServer(object):
+    def __init__(self, message="Hello from Mac Server!",
+            characteristic_uuid=CHARACTERISTIC_UUID):
+        self.message = message
+        self.characteristic_uuid = characteristic_uuid
+        self.handlers = {}
+        self.readers = {}
+        self.register(OP_PING, lambda payload: payload)
+        self.register(OP_READ, self._read)
+        self.register(OP_WRITE, self._write)
+
+    def register(self, opcode, handler):
+        self.handlers[opcode] = handler
+
+    # Serve reads of another characteristic, e.g. the profile digest.
+    def register_reader(self, uuid, reader):
+        self.readers[str(uuid).lower()] = reader
+
+    def _read(self, payload):
+        return self.message.encode()
+
+    def _write(self, payload):
+        self.message = str(payload, 'utf-8')
+        return payload
+
+    def handle(self, data):
+        seq, opcode, _, payload = decode_frame(data)
+        handler = self.handlers.get(opcode)
+        if handler is None:
+            return encode_frame(seq, opcode, status=STATUS_UNKNOWN_OPCODE)
+        try:
+            result = handler(payload)
+        except Exception as e:
+            return encode_frame(seq, opcode, str(e).encode(), STATUS_ERROR)
+        return encode_frame(seq, opcode, result or b"")
+
+    # Simulated GATT server interface (see sim_link.py)
+    def on_read(self, link, uuid):
+        reader = self.readers.get(str(uuid).lower())
+        if reader is not None:
+            return reader()
+        return self.message.encode()
+
+    def on_write(self, link, uuid, data):
+        if is_frame(data):
+            link.notify(uuid, self.handle(data))
+        else:
+            self.message = str(data, 'utf-8')
+
+# Client side
+
+class PipelinedClient(object):
+    def __init__(self, client, characteristic_uuid=CHARACTERISTIC_UUID,
+            timeout=2.0, max_in_flight=32):
+        self.client = client
+        self.characteristic_uuid = characteristic_uuid
+        self.timeout = timeout
+        self.pending = {}
+        self._next_seq = 0
+        self._window = asyncio.Semaphore(max_in_flight)
+
+    async def start(self):
+        await self.client.start_notify(self.characteristic_uuid,
+            self._on_notify)
+
+    async def stop(self):
+        await self.client.stop_notify(self.characteristic_uuid)
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Client stopped"))
+        self.pending.clear()
+
+    def _on_notify(self, sender, data):
+        if len(data) and data[0] == BATCH_MAGIC:
+            for frame in decode_batch(data):
+                self._on_frame(frame)
+        elif is_frame(data):
+            self._on_frame(data)
+
+    def _on_frame(self, data):
+        seq, opcode, status, payload = decode_frame(data)
+        future = self.pending.pop(seq, None)
+        if future is None or future.done():
+            return  # Timed out already
+        if status != STATUS_OK:
+            future.set_exception(CommandError(opcode, status, payload))
+        else:
+            future.set_result(payload)
+
+    def _allocate_seq(self):
+        for _ in range(0x10000):
+            seq = self._next_seq
+            self._next_seq = (seq + 1) & 0xFFFF
+            if seq not in self.pending:
+                return seq
+        raise RuntimeError("No free sequence ids")
+
+    async def request(self, opcode, payload=b"", timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        async with self._window:
+            loop = asyncio.get_running_loop()
+            seq = self._allocate_seq()
+            future = loop.create_future()
+            self.pending[seq] = future
+            handle = loop.call_later(timeout, self._expire, seq, opcode)
+            try:
+                await self.client.write_gatt_char(self.characteristic_uuid,
+                    encode_frame(seq, opcode, payload), response=False)
+                return await future
+            finally:
+                handle.cancel()
+                self.pending.pop(seq, None)
+
+    def _expire(self, seq, opcode):
+        future = self.pending.pop(seq, None)
+        if future is not None and not future.done():
+            future.set_exception(asyncio.TimeoutError(
+                f"Command {opcode:#04x} (seq {seq}) timed out"))
+
+    async def read(self, timeout=None):
+        return await self.request(OP_READ, timeout=timeout)
+
+    async def write(self, value, timeout=None):
+        return await self.request(OP_WRITE, value, timeout=timeout)
+
+    async def ping(self, payload=b"", timeout=None):
+        return await self.request(OP_PING, payload, timeout=timeout)
+
+#################
+### BENCHMARK ###
+#################
+# Both sides do the same work: n read -> write -> read exchanges, i.e.
+# 3n operations (ATT requests for the serialized client, commands for the
+# pipelined one).
+async def _serialized(client, n):
+    # The read -> write -> read pattern from gatt_client.exchange
+    for i in range(n):
+        await client.read_gatt_char(CHARACTERISTIC_UUID)
+        await client.write_gatt_char(CHARACTERISTIC_UUID,
+            f"PTA Threshold: {i}dB!".encode("utf-8"), response=True)
+        await client.read_gatt_char(CHARACTERISTIC_UUID)
+
+async def _pipelined(client, n):
+    commands = PipelinedClient(client)
+    await commands.start()
+
+    # Each exchange is still ordered; the exchanges overlap.
+    async def exchange(i):
+        await commands.read()
+        await commands.write(f"PTA Threshold: {i}dB!".encode())
+        await commands.read()
+
+    await asyncio.gather(*[exchange(i) for i in range(n)])
+    await commands.stop()
+
+async def benchmark(n=200, interval=0.0075, packets_per_event=4):
+    from sim_link import SimulatedLink
+    results = {}
+    for name, run in [("serialized", _serialized), ("pipelined", _pipelined)]:
+        server = CommandServer()
+        async with SimulatedLink(server, interval, packets_per_event) as link:
+            t0 = time.perf_counter()
+            await run(link, n)
+            elapsed = time.perf_counter() - t0
+        results[name] = 3 * n / elapsed
+        print(f"{name:>10}: {n} read/write/read exchanges in {elapsed:.3f}s"
+            f" = {3 * n / elapsed:8.1f} operations/s ({link.events} events)")
+    print(f"Speedup: {results['pipelined'] / results['serialized']:.1f}x")
+    return results
+
+if __name__ == "__main__":
+    asyncio.run(benchmark())
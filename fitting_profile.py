@@ -0,0 +1,54 @@
+import struct
+
+# Wire layout of a fitting profile.
+#
+# A profile is split into sections, one per (side, field), each holding one
+# byte per fitting frequency. Sections are the unit of transfer and of
+# verification: the device keeps a CRC per section.
+SIDES = ["left", "right"]
+FIELDS = ["audiogram", "soft_gains", "moderate_gains", "loud_gains", "mpos"]
+
+# Thresholds and MPOs are unsigned dB values; gains may go negative.
+FIELD_FORMATS = {
+    "audiogram": "B",
+    "soft_gains": "b",
+    "moderate_gains": "b",
+    "loud_gains": "b",
+    "mpos": "B",
+}
+
+# Fitting frequency grid (Hz), one band per frequency.
+FREQUENCIES = [250, 500, 1000, 2000, 3000, 4000, 6000, 8000]
+
+# Limits for gains adjusted from the fitting GUI.
+MIN_GAIN_dB = 0
+MAX_GAIN_dB = 60
+
+# Moves a gain by step, clamped to the limits only in the direction of the
+# step: a gain already outside them (e.g. a soft gain of 80 dB from
+# calculate_gain) is never moved against the step.
+def step_gain(value, step):
+    if step > 0:
+        return max(min(value + step, MAX_GAIN_dB), value)
+    return min(max(value + step, MIN_GAIN_dB), value)
+
+SECTION_NAMES = [f"{side}_{field}" for side in SIDES for field in FIELDS]
+
+def section_index(side, field):
+    return SIDES.index(side) * len(FIELDS) + FIELDS.index(field)
+
+def encode_section(field, values):
+    return struct.pack(f"<{len(values)}{FIELD_FORMATS[field]}",
+        *[int(v) for v in values])
+
+def decode_section(field, data):
+    return list(struct.unpack(f"<{len(data)}{FIELD_FORMATS[field]}", data))
+
+# Sections are read from ControllerState-style attributes, e.g.
+# state.left_audiogram or state.right_moderate_gains.
+def encode_sections(state):
+    return [encode_section(field, getattr(state, f"{side}_{field}"))
+        for side in SIDES for field in FIELDS]
+
+def encode_profile(state):
+    return b"".join(encode_sections(state))
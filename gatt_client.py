@@ -0,0 +1,37 @@
+from ble_config import CHARACTERISTIC_UUID, NUM_BANDS
+from command_protocol import PipelinedClient
+from fitting_profile import FIELDS, SIDES, encode_section
+from profile_sync import ProfileSync
+
+# The read -> write exchange of the demo client. Works with any
+# BleakClient-like object (BleakClient, SimulatedLink). The write is sent
+# with response, so the ATT acknowledgement confirms it; it is not read
+# back.
+async def exchange(client, new_value="PTA Threshold: 40dB!"):
+    value = await client.read_gatt_char(CHARACTERISTIC_UUID)
+    print(f"Read Initial State: {value.decode()}")
+
+    await client.write_gatt_char(CHARACTERISTIC_UUID,
+        new_value.encode("utf-8"), response=True)
+    print(f"Write new state: {new_value} (acknowledged)")
+
+# Flat 40 dB HL audiogram with half-gain rule gains, for the demo push.
+def demo_profile(n_bands=NUM_BANDS):
+    values = {"audiogram": 40, "soft_gains": 25, "moderate_gains": 20,
+        "loud_gains": 10, "mpos": 100}
+    return [encode_section(field, [values[field]] * n_bands)
+        for _ in SIDES for field in FIELDS]
+
+# Pushes profile sections (see fitting_profile.encode_sections) and
+# confirms them by the device digest instead of a full read-back (see
+# profile_sync.ProfileSync).
+async def push_profile(client, sections, n_bands=NUM_BANDS):
+    commands = PipelinedClient(client)
+    await commands.start()
+    try:
+        sync = ProfileSync(commands, client, n_bands)
+        await sync.push(sections)
+    finally:
+        await commands.stop()
+    print(f"Push profile: verified by digest, {sync.stats}")
+    return sync
@@ -0,0 +1,152 @@
+from collections import deque
+
+from ble_config import CHARACTERISTIC_UUID, NUM_BANDS
+from command_protocol import CommandServer, encode_batch, is_frame, \
+    BATCH_LENGTH
+from profile_sync import ProfileStore
+
+# GATT server core with one session per connected central.
+#
+# Every central gets its own CommandServer, so its message and in-flight
+# commands are isolated from the others; the device profile (ProfileStore)
+# is shared. Incoming command frames are queued per session and processed
+# round-robin, at most `budget` frames per session per round, so a chatty
+# central cannot starve the rest. Responses and broadcasts are queued per
+# session and sent as batched notifications (several frames per packet,
+# up to the MTU).
+#
+# The transport is abstracted by the `send(data) -> bool` callable of each
+# session (False if the link's transmit queue is full), and `schedule(fn)`
+# which runs fn soon on the server's event loop.
+
+class CentralSession(object):
+    def __init__(self, identifier, send, profile, message):
+        self.identifier = identifier
+        self.send = send
+        self.commands = CommandServer(message)
+        if profile is not None:
+            profile.attach(self.commands)
+        # Frames stay in the outbox until the central subscribes to
+        # notifications (the backend sets this, then flushes).
+        self.subscribed = False
+        self.inbox = deque()
+        self.outbox = deque()
+        self.requests = 0
+        self.notifications = 0
+
+    @property
+    def message(self):
+        return self.commands.message
+
+class MultiCentralServer(object):
+    def __init__(self, schedule=None, message="Hello from Mac Server!",
+            n_bands=NUM_BANDS, budget=4, max_per_drain=256, mtu=185,
+            characteristic_uuid=CHARACTERISTIC_UUID):
+        self.schedule = schedule
+        self.message = message
+        self.profile = ProfileStore(n_bands)
+        self.budget = budget
+        self.max_per_drain = max_per_drain
+        # ATT notifications carry MTU - 3 bytes.
+        self.max_payload = mtu - 3
+        self.characteristic_uuid = characteristic_uuid
+        self.sessions = {}
+        self._drain_scheduled = False
+
+    def session(self, identifier, send=None):
+        session = self.sessions.get(identifier)
+        if session is None:
+            session = CentralSession(identifier, send, self.profile,
+                self.message)
+            self.sessions[identifier] = session
+        elif send is not None:
+            session.send = send
+        return session
+
+    def remove_session(self, identifier):
+        self.sessions.pop(identifier, None)
+
+    def read(self, session, uuid):
+        return session.commands.on_read(None, uuid)
+
+    def write(self, session, data):
+        session.requests += 1
+        if is_frame(data):
+            session.inbox.append(data)
+            self._schedule_drain()
+        else:
+            session.commands.message = str(data, 'utf-8')
+
+    def _schedule_drain(self):
+        if self._drain_scheduled:
+            return
+        self._drain_scheduled = True
+        if self.schedule is None:
+            self.drain()
+        else:
+            self.schedule(self.drain)
+
+    def drain(self):
+        self._drain_scheduled = False
+        processed = 0
+        busy = [s for s in self.sessions.values() if s.inbox]
+        while busy and processed < self.max_per_drain:
+            for session in busy:
+                for _ in range(min(self.budget, len(session.inbox))):
+                    session.outbox.append(
+                        session.commands.handle(session.inbox.popleft()))
+                    processed += 1
+            busy = [s for s in busy if s.inbox]
+        for session in self.sessions.values():
+            if session.outbox:
+                self.flush(session)
+        if busy:
+            self._schedule_drain()
+
+    # Sends as many batched notifications as the link accepts.
+    def flush(self, session):
+        if not session.subscribed or session.send is None:
+            return
+        while session.outbox:
+            frames = [session.outbox.popleft()]
+            size = 1 + BATCH_LENGTH.size + len(frames[0])
+            while session.outbox and size + BATCH_LENGTH.size \
+                    + len(session.outbox[0]) <= self.max_payload:
+                size += BATCH_LENGTH.size + len(session.outbox[0])
+                frames.append(session.outbox.popleft())
+            data = frames[0] if len(frames) == 1 else encode_batch(frames)
+            if not session.send(data):
+                session.outbox.extendleft(reversed(frames))
+                return
+            session.notifications += 1
+
+    # Same frame to every subscribed central; encoded once.
+    def broadcast(self, frame):
+        for session in self.sessions.values():
+            if session.subscribed:
+                session.outbox.append(frame)
+        for session in self.sessions.values():
+            self.flush(session)
+
+    def flush_all(self):
+        for session in self.sessions.values():
+            self.flush(session)
+
+    # Simulated GATT server interface (see sim_link.py)
+
+    def _link_session(self, link):
+        return self.session(link.identifier,
+            lambda data: link.notify(self.characteristic_uuid, data))
+
+    # Simulated centrals are subscribed as soon as they connect.
+    def on_connect(self, link):
+        self._link_session(link).subscribed = True
+
+    def on_disconnect(self, link):
+        self.remove_session(link.identifier)
+
+    def on_read(self, link, uuid):
+        return self.read(self._link_session(link), uuid)
+
+    def on_write(self, link, uuid, data):
+        self.write(self._link_session(link), data)
@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import struct
+import time
+
+# Recording and replay of GATT traffic.
+#
+# Trace file layout (little endian):
+#
+#   header: magic "GTRC" | version (u8) | 3 pad bytes | start time (f64)
+#   record: dt (u32, microseconds since the previous record) | op (u8)
+#           | uuid index (u8) | payload length (u16) | payload
+#
+# UUIDs are written once as OP_UUID records (payload: the UUID string) and
+# referred to by index afterwards, so a record costs 8 bytes plus payload.
+TRACE_MAGIC = b"GTRC"
+TRACE_VERSION = 1
+HEADER = struct.Struct("<4sBxxxd")
+RECORD = struct.Struct("<IBBH")
+
+OP_UUID = 0
+OP_READ = 1         # client read request
+OP_READ_RESPONSE = 2
+OP_WRITE = 3        # write with response
+OP_WRITE_NO_RESPONSE = 4
+OP_NOTIFY = 5
+
+OP_NAMES = {
+    OP_UUID: "uuid",
+    OP_READ: "read",
+    OP_READ_RESPONSE: "read-response",
+    OP_WRITE: "write",
+    OP_WRITE_NO_RESPONSE: "write-nr",
+    OP_NOTIFY: "notify",
+}
+
+# Ops issued by the client; the others are produced by the server.
+CLIENT_OPS = (OP_READ, OP_WRITE, OP_WRITE_NO_RESPONSE)
+
+class TraceWriter(object):
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.start = time.time()
+        self.file.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, self.start))
+        self.uuids = {}
+        self._last = time.perf_counter()
+
+    def _uuid_index(self, uuid):
+        uuid = str(uuid).lower()
+        index = self.uuids.get(uuid)
+        if index is None:
+            index = len(self.uuids)
+            if index > 0xFF:
+                raise ValueError("Too many characteristics in one trace")
+            self.uuids[uuid] = index
+            self._write(OP_UUID, index, uuid.encode())
+        return index
+
+    def _write(self, op, index, payload):
+        now = time.perf_counter()
+        dt = min(int((now - self._last) * 1e6), 0xFFFFFFFF)
+        self._last = now
+        self.file.write(RECORD.pack(dt, op, index, len(payload)))
+        self.file.write(payload)
+
+    def record(self, op, uuid, payload=b""):
+        self._write(op, self._uuid_index(uuid), bytes(payload or b""))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Yields (t, op, uuid, payload), t in seconds since the start of the trace.
+# A truncated last record is dropped.
+def read_trace(path):
+    with open(path, "rb") as f:
+        magic, version, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise ValueError(f"Not a version {TRACE_VERSION} GATT trace:"
+                f" {path}")
+        uuids = {}
+        t = 0.0
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            dt, op, index, length = RECORD.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return # Cut off while recording, e.g. by a crash
+            t += dt / 1e6
+            if op == OP_UUID:
+                uuids[index] = payload.decode()
+                continue
+            yield t, op, uuids[index], payload
+
+# Recording wrappers
+
+# Wraps a BleakClient-like client and records its traffic.
+class RecordingClient(object):
+    def __init__(self, client, writer):
+        self.client = client
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    async def __aenter__(self):
+        await self.client.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        return await self.client.__aexit__(*exc)
+
+    async def read_gatt_char(self, uuid):
+        self.writer.record(OP_READ, uuid)
+        value = await self.client.read_gatt_char(uuid)
+        self.writer.record(OP_READ_RESPONSE, uuid, value)
+        return value
+
+    async def write_gatt_char(self, uuid, data, response=False):
+        self.writer.record(OP_WRITE if response else OP_WRITE_NO_RESPONSE,
+            uuid, data)
+        return await self.client.write_gatt_char(uuid, data,
+            response=response)
+
+    async def start_notify(self, uuid, callback):
+        def recording_callback(sender, data):
+            self.writer.record(OP_NOTIFY, uuid, data)
+            callback(sender, data)
+        return await self.client.start_notify(uuid, recording_callback)
+
+class _RecordingLink(object):
+    def __init__(self, link, writer):
+        self.link = link
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.link, name)
+
+    def notify(self, uuid, data):
+        self.writer.record(OP_NOTIFY, uuid, data)
+        return self.link.notify(uuid, data)
+
+# Wraps a simulated GATT server (on_read/on_write, see sim_link.py) and
+# records the requests it receives and what it sends back.
+class RecordingServer(object):
+    def __init__(self, server, writer):
+        self.server = server
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.server, name)
+
+    def on_read(self, link, uuid):
+        self.writer.record(OP_READ, uuid)
+        value = self.server.on_read(_RecordingLink(link, self.writer), uuid)
+        self.writer.record(OP_READ_RESPONSE, uuid, value)
+        return value
+
+    def on_write(self, link, uuid, data):
+        # Responses are not visible here, so writes are recorded as
+        # write-nr; replay treats both the same on the server side.
+        self.writer.record(OP_WRITE_NO_RESPONSE, uuid, data)
+        self.server.on_write(_RecordingLink(link, self.writer), uuid, data)
+
+# Replay
+
+class ReplayStats(object):
+    def __init__(self):
+        self.ops = 0
+        self.mismatches = 0
+        self.latencies = []
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        latencies = sorted(self.latencies)
+        n = len(latencies)
+        p50 = latencies[n // 2] * 1e3 if n else 0.0
+        p99 = latencies[int(n * 0.99)] * 1e3 if n else 0.0
+        return (f"ReplayStats(ops={self.ops}, mismatches={self.mismatches},"
+            f" elapsed={self.elapsed:.3f}s,"
+            f" ops/s={self.ops / max(self.elapsed, 1e-9):.1f},"
+            f" p50={p50:.2f}ms, p99={p99:.2f}ms)")
+
+# speed: 1.0 = real time, N = N times faster, 0 = as fast as possible.
+async def _pace(t0, t, speed):
+    if speed:
+        delay = t / speed - (time.perf_counter() - t0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+# Drives a client (BleakClient or SimulatedLink) with the client requests of
+# a trace. Read responses are compared with the recorded ones.
+async def replay_client(records, client, speed=0.0):
+    stats = ReplayStats()
+    notify_uuids = {uuid for _, op, uuid, _ in records if op == OP_NOTIFY}
+    for uuid in notify_uuids:
+        await client.start_notify(uuid, lambda sender, data: None)
+
+    expected = {}
+    for i, (_, op, uuid, payload) in enumerate(records):
+        if op == OP_READ_RESPONSE:
+            # Match each response with the latest read of the same UUID.
+            for j in range(i - 1, -1, -1):
+                if records[j][1] == OP_READ and records[j][2] == uuid \
+                        and j not in expected:
+                    expected[j] = payload
+                    break
+
+    # A single ordered sender, at every speed: requests go out in recorded
+    # order, reads and acknowledged writes wait for their response (one
+    # outstanding ATT request, like the recorded client), and
+    # unacknowledged writes only wait until the link has queued them, so
+    # they pipeline like they did. Speed only paces the send times.
+    t0 = time.perf_counter()
+    for i, (t, op, uuid, payload) in enumerate(records):
+        if op not in CLIENT_OPS:
+            continue
+        await _pace(t0, t, speed)
+        stats.ops += 1
+        start = time.perf_counter()
+        if op == OP_READ:
+            value = await client.read_gatt_char(uuid)
+            if i in expected and bytes(value) != expected[i]:
+                stats.mismatches += 1
+        else:
+            await client.write_gatt_char(uuid, payload,
+                response=(op == OP_WRITE))
+        stats.latencies.append(time.perf_counter() - start)
+    stats.elapsed = time.perf_counter() - t0
+    return stats
+
+class _CaptureLink(object):
+    identifier = "replay"
+
+    def __init__(self):
+        self.notifications = []
+
+    def notify(self, uuid, data):
+        self.notifications.append((str(uuid).lower(), bytes(data)))
+        return True
+
+# Drives a simulated GATT server with the client requests of a trace and
+# checks that it produces the recorded read responses and notifications.
+async def replay_server(records, server, speed=0.0):
+    stats = ReplayStats()
+    link = _CaptureLink()
+    produced = []
+    t0 = time.perf_counter()
+    for t, op, uuid, payload in records:
+        if op not in CLIENT_OPS:
+            continue
+        await _pace(t0, t, speed)
+        stats.ops += 1
+        start = time.perf_counter()
+        if op == OP_READ:
+            produced.append((OP_READ_RESPONSE, uuid.lower(),
+                bytes(server.on_read(link, uuid))))
+        else:
+            server.on_write(link, uuid, payload)
+            produced.extend((OP_NOTIFY, u, d) for u, d in link.notifications)
+            link.notifications.clear()
+        stats.latencies.append(time.perf_counter() - start)
+    stats.elapsed = time.perf_counter() - t0
+
+    recorded = [(op, uuid.lower(), payload) for _, op, uuid, payload
+        in records if op in (OP_READ_RESPONSE, OP_NOTIFY)]
+    stats.mismatches = sum(a != b for a, b in zip(produced, recorded)) \
+        + abs(len(produced) - len(recorded))
+    return stats
+
+############
+### MAIN ###
+############
+
+# Records a simulated session: plain read/write/read, then pipelined
+# profile pushes.
+async def record_demo(path, n_pushes=50):
+    import random
+    from command_protocol import PipelinedClient
+    from fitting_profile import SECTION_NAMES
+    from gatt_client import exchange
+    from profile_sync import ProfileSync
+    from backend_simulated import make_server
+    from sim_link import SimulatedLink
+    from ble_config import NUM_BANDS
+
+    random.seed(0)
+    with TraceWriter(path) as writer:
+        async with SimulatedLink(make_server()) as link:
+            client = RecordingClient(link, writer)
+            await exchange(client)
+            commands = PipelinedClient(client)
+            await commands.start()
+            sync = ProfileSync(commands, client, NUM_BANDS)
+            sections = [bytes(NUM_BANDS) for _ in SECTION_NAMES]
+            for _ in range(n_pushes):
+                i = random.randrange(len(sections))
+                sections[i] = bytes(random.randrange(60)
+                    for _ in range(NUM_BANDS))
+                await sync.push(sections)
+            await commands.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="GATT trace tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("record-demo", help="Record a simulated session")
+    p.add_argument("path")
+    p = sub.add_parser("info", help="Print the records of a trace")
+    p.add_argument("path")
+    p = sub.add_parser("replay", help="Replay a trace against the"
+        " simulated server")
+    p.add_argument("path")
+    p.add_argument("--side", choices=["client", "server"], default="client")
+    p.add_argument("--speed", type=float, default=1.0,
+        help="1 = real time, N = N times faster, 0 = as fast as possible")
+    args = parser.parse_args()
+
+    if args.command == "record-demo":
+        asyncio.run(record_demo(args.path))
+    elif args.command == "info":
+        for t, op, uuid, payload in read_trace(args.path):
+            print(f"{t:10.6f} {OP_NAMES[op]:>13} {uuid} {payload.hex()}")
+    else:
+        from backend_simulated import make_server
+        from sim_link import SimulatedLink
+        records = list(read_trace(args.path))
+
+        async def run():
+            if args.side == "server":
+                return await replay_server(records, make_server(), args.speed)
+            async with SimulatedLink(make_server()) as link:
+                return await replay_client(records, link, args.speed)
+        print(asyncio.run(run()))
+
+if __name__ == "__main__":
+    main()
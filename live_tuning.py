@@ -0,0 +1,191 @@
+import asyncio
+import random
+import threading
+import time
+
+# Latest-value-wins push queue for live tuning.
+#
+# submit() may be called from any thread (e.g. Tk button callbacks) and only
+# records the newest value per key. The flusher runs on the BLE event loop
+# and sends everything pending as one batch, at most once per connection
+# interval and never while the previous batch is still unacknowledged, so
+# a burst of clicks collapses into a few writes instead of a radio backlog.
+class LatestValuePushQueue(object):
+    def __init__(self, send, interval=0.0075, loop=None):
+        self.send = send
+        self.interval = interval
+        self.loop = loop
+        self.pending = {}
+        self.submitted = 0
+        self.writes = 0
+        self.latencies = []
+        # Batch taken from pending and not yet acknowledged.
+        self.in_flight = None
+        self._lock = threading.Lock()
+        self._wake = None
+        self._task = None
+
+    def submit(self, key, value):
+        now = time.perf_counter()
+        with self._lock:
+            _, times = self.pending.get(key, (None, []))
+            times.append(now)
+            self.pending[key] = (value, times)
+            self.submitted += 1
+        if self.loop is not None and self._wake is not None:
+            self.loop.call_soon_threadsafe(self._wake.set)
+
+    def _take(self):
+        with self._lock:
+            pending = self.pending
+            self.pending = {}
+        return pending
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            pending = self._take()
+            if not pending:
+                continue
+            t0 = self.loop.time()
+            self.in_flight = pending
+            try:
+                await self.send({k: v for k, (v, _) in pending.items()})
+            except Exception:
+                # Put back anything not superseded meanwhile and retry.
+                with self._lock:
+                    for key, item in pending.items():
+                        self.pending.setdefault(key, item)
+                self._wake.set()
+            else:
+                self.writes += 1
+                done = time.perf_counter()
+                for _, times in pending.values():
+                    self.latencies.extend(done - t for t in times)
+            finally:
+                self.in_flight = None
+            elapsed = self.loop.time() - t0
+            if elapsed < self.interval:
+                await asyncio.sleep(self.interval - elapsed)
+
+    def start(self):
+        if self._task is not None:
+            return self
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        if self.pending:
+            self._wake.set()
+        self._task = self.loop.create_task(self._run())
+        return self
+
+    # With drain, waits for queued values and for the batch being sent, for
+    # at most `timeout` seconds: on a dead link send keeps failing and the
+    # batch keeps being put back. Returns False if values were left unsent.
+    async def stop(self, drain=True, timeout=2.0):
+        if self._task is None:
+            return True
+        deadline = self.loop.time() + timeout
+        while drain and (self.pending or self.in_flight is not None) \
+                and self.loop.time() < deadline:
+            await asyncio.sleep(self.interval)
+        drained = not self.pending and self.in_flight is None
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        return drained
+
+# Send function for a profile_sync.ProfileSync: the batch is applied to
+# `sections` (the full local profile), the sections that changed go out
+# as one command and the push is confirmed by the device digest. A failed
+# verification raises, so the queue retries the batch.
+def profile_sender(sync, sections):
+    async def send(batch):
+        for i, value in batch.items():
+            sections[i] = value
+        await sync.push(sections)
+    return send
+
+#################
+### BENCHMARK ###
+#################
+async def _clicks(n_bursts, n_bands, on_click):
+    from fitting_profile import MAX_GAIN_dB
+    gains = [0] * n_bands
+    for _ in range(n_bursts):
+        # Clinician clicking in bursts: fast repeats, then a pause.
+        band = random.randrange(n_bands)
+        for _ in range(random.randint(1, 8)):
+            gains[band] = min(gains[band] + 1, MAX_GAIN_dB)
+            on_click(list(gains))
+            await asyncio.sleep(random.uniform(0.01, 0.05))
+        await asyncio.sleep(random.uniform(0.1, 0.3))
+    return gains
+
+def _report(name, clicks, writes, latencies):
+    latencies = sorted(latencies)
+    n = len(latencies)
+    print(f"{name:>10}: {clicks} clicks -> {writes} writes,"
+        f" click-to-device p50={latencies[n // 2] * 1e3:6.1f}ms"
+        f" p99={latencies[int(n * 0.99)] * 1e3:6.1f}ms"
+        f" max={latencies[-1] * 1e3:6.1f}ms")
+
+async def benchmark(n_bursts=40, interval=0.030, n_bands=8):
+    from command_protocol import CommandServer, PipelinedClient, \
+        CHARACTERISTIC_UUID
+    from fitting_profile import SECTION_NAMES, section_index, \
+        encode_section
+    from profile_sync import ProfileStore, ProfileSync
+    from sim_link import SimulatedLink
+
+    key = section_index("left", "moderate_gains")
+
+    # Baseline: every click is written with response and read back to
+    # confirm it, in order.
+    server = CommandServer()
+    async with SimulatedLink(server, interval) as link:
+        clicks = asyncio.Queue()
+        latencies = []
+
+        async def writer():
+            while True:
+                t, gains = await clicks.get()
+                value = encode_section("moderate_gains", gains)
+                await link.write_gatt_char(CHARACTERISTIC_UUID, value,
+                    response=True)
+                await link.read_gatt_char(CHARACTERISTIC_UUID)
+                latencies.append(time.perf_counter() - t)
+                clicks.task_done()
+
+        task = asyncio.ensure_future(writer())
+        random.seed(0)
+        await _clicks(n_bursts, n_bands,
+            lambda gains: clicks.put_nowait((time.perf_counter(), gains)))
+        await clicks.join()
+        task.cancel()
+    _report("per-click", len(latencies), len(latencies), latencies)
+
+    server = CommandServer()
+    store = ProfileStore(n_bands).attach(server)
+    async with SimulatedLink(server, interval) as link:
+        commands = PipelinedClient(link)
+        await commands.start()
+        sync = ProfileSync(commands, link, n_bands)
+        sections = [bytes(n_bands) for _ in SECTION_NAMES]
+        queue = LatestValuePushQueue(profile_sender(sync, sections),
+            interval)
+        queue.start()
+        random.seed(0) # Same clicks as the per-click run
+        gains = await _clicks(n_bursts, n_bands, lambda gains:
+            queue.submit(key, encode_section("moderate_gains", gains)))
+        await queue.stop()
+        await commands.stop()
+    assert store.section(key) == encode_section("moderate_gains", gains)
+    _report("coalesced", queue.submitted, queue.writes, queue.latencies)
+
+if __name__ == "__main__":
+    asyncio.run(benchmark())
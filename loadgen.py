@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import time
+
+from command_protocol import PipelinedClient
+from gatt_server import MultiCentralServer
+from sim_link import SharedRadio, SimulatedLink
+
+# Load generator for MultiCentralServer: N simulated centrals, each running
+# `workers` closed-loop command streams (write own value, read it back)
+# for `duration` seconds. Reports throughput, tail latency, and whether any
+# central ever read another central's value. All links share one radio
+# budget of `radio_packets` per connection interval.
+
+async def _central(link, workers, deadline, latencies, errors):
+    commands = PipelinedClient(link)
+    await commands.start()
+
+    async def worker(w):
+        k = 0
+        while time.perf_counter() < deadline:
+            value = f"{link.identifier}/{w}/{k}".encode()
+            t0 = time.perf_counter()
+            await commands.write(value)
+            read_back = await commands.read()
+            latencies.append(time.perf_counter() - t0)
+            # Other workers of this central may have written in between,
+            # but never another central.
+            if not read_back.startswith(f"{link.identifier}/".encode()):
+                errors.append((link.identifier, read_back))
+            k += 1
+
+    await asyncio.gather(*[worker(w) for w in range(workers)])
+    await commands.stop()
+
+async def run_load(n_centrals, duration=2.0, workers=4, interval=0.0075,
+        radio_packets=64):
+    loop = asyncio.get_running_loop()
+    server = MultiCentralServer(schedule=loop.call_soon)
+    radio = SharedRadio(radio_packets, interval)
+    links = [SimulatedLink(server, interval, identifier=f"central-{i}",
+        radio=radio) for i in range(n_centrals)]
+    for link in links:
+        await link.connect()
+
+    latencies = []
+    errors = []
+    t0 = time.perf_counter()
+    await asyncio.gather(*[_central(link, workers, t0 + duration,
+        latencies, errors) for link in links])
+    elapsed = time.perf_counter() - t0
+    notifications = sum(s.notifications for s in server.sessions.values())
+    for link in links:
+        await link.disconnect()
+
+    latencies.sort()
+    n = len(latencies)
+    # Each measured command is a write plus a read.
+    return {
+        "centrals": n_centrals,
+        "commands_per_s": 2 * n / elapsed,
+        "p50_ms": latencies[n // 2] * 1e3,
+        "p99_ms": latencies[int(n * 0.99)] * 1e3,
+        "max_ms": latencies[-1] * 1e3,
+        "frames_per_notification": 2 * n / max(notifications, 1),
+        "isolation_errors": len(errors),
+    }
+
+async def main(centrals, duration, workers, radio_packets):
+    for n in centrals:
+        r = await run_load(n, duration, workers, radio_packets=radio_packets)
+        print(f"N={r['centrals']:3d}: {r['commands_per_s']:8.1f} commands/s"
+            f"  p50={r['p50_ms']:6.1f}ms p99={r['p99_ms']:6.1f}ms"
+            f" max={r['max_ms']:6.1f}ms"
+            f"  frames/notification={r['frames_per_notification']:.2f}"
+            f"  isolation errors={r['isolation_errors']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-central load test")
+    parser.add_argument("--centrals", type=int, nargs="+",
+        default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--duration", type=float, default=2.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--radio-packets", type=int, default=64,
+        help="Packets per connection interval shared by all centrals")
+    args = parser.parse_args()
+    asyncio.run(main(args.centrals, args.duration, args.workers,
+        args.radio_packets))
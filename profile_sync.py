@@ -0,0 +1,226 @@
+import asyncio
+import random
+import struct
+import zlib
+
+from command_protocol import CommandServer, PipelinedClient, \
+    CHARACTERISTIC_UUID
+from fitting_profile import SECTION_NAMES
+
+# Small read-only characteristic exposing the applied profile's digest.
+DIGEST_CHARACTERISTIC_UUID = "87654321-4321-8765-4321-fedcba987655"
+
+OP_WRITE_SECTION = 0x10
+OP_READ_RANGE = 0x11
+OP_READ_CRCS = 0x12
+OP_WRITE_SECTIONS = 0x13
+
+RANGE = struct.Struct("<HH")
+
+def section_crcs(sections):
+    return [zlib.crc32(section) for section in sections]
+
+def combine_crcs(crcs):
+    return zlib.crc32(struct.pack(f"<{len(crcs)}I", *crcs))
+
+def encode_crcs(crcs):
+    return struct.pack(f"<{len(crcs)}I", *crcs)
+
+def decode_crcs(data):
+    return list(struct.unpack(f"<{len(data) // 4}I", data))
+
+# Several sections in one write: (index (u8) | section bytes) repeated.
+def encode_section_batch(sections):
+    return b"".join(bytes([i]) + section for i, section in sections.items())
+
+# Device side
+
+# Applied profile plus a CRC per section. Applying a section only rehashes
+# that section, and the digest is a CRC over the per-section CRCs, so
+# keeping it current is cheap. The digest characteristic only carries the
+# 4 byte combined CRC; the per-section CRCs are fetched on mismatch.
+class ProfileStore(object):
+    def __init__(self, n_bands, n_sections=len(SECTION_NAMES)):
+        self.n_bands = n_bands
+        self.n_sections = n_sections
+        self.data = bytearray(n_bands * n_sections)
+        self.crcs = [zlib.crc32(bytes(n_bands))] * n_sections
+        self._digest = struct.pack("<I", combine_crcs(self.crcs))
+
+    def section(self, i):
+        return bytes(self.data[i * self.n_bands:(i + 1) * self.n_bands])
+
+    def apply_section(self, i, payload):
+        if not 0 <= i < self.n_sections or len(payload) != self.n_bands:
+            raise ValueError(f"Bad section write: index {i},"
+                f" {len(payload)} bytes")
+        self.data[i * self.n_bands:(i + 1) * self.n_bands] = payload
+        self.crcs[i] = zlib.crc32(payload)
+        self._digest = struct.pack("<I", combine_crcs(self.crcs))
+
+    def read_range(self, offset, length):
+        if offset + length > len(self.data):
+            raise ValueError(f"Range {offset}+{length} out of bounds")
+        return bytes(self.data[offset:offset + length])
+
+    def digest(self):
+        return self._digest
+
+    def _write_section(self, payload):
+        self.apply_section(payload[0], payload[1:])
+        return b""
+
+    def _write_section_batch(self, payload):
+        step = self.n_bands + 1
+        # Checked up front so a malformed batch applies nothing.
+        if len(payload) % step:
+            raise ValueError(f"Bad section batch: {len(payload)} bytes,"
+                f" not a multiple of {step}")
+        if payload and max(payload[::step]) >= self.n_sections:
+            raise ValueError(f"Bad section batch: index"
+                f" {max(payload[::step])}")
+        for offset in range(0, len(payload), step):
+            self.apply_section(payload[offset],
+                payload[offset + 1:offset + step])
+        return b""
+
+    def _read_range(self, payload):
+        return self.read_range(*RANGE.unpack(payload))
+
+    def _read_crcs(self, payload):
+        return encode_crcs(self.crcs)
+
+    def attach(self, server):
+        server.register(OP_WRITE_SECTION, self._write_section)
+        server.register(OP_READ_RANGE, self._read_range)
+        server.register(OP_READ_CRCS, self._read_crcs)
+        server.register(OP_WRITE_SECTIONS, self._write_section_batch)
+        server.register_reader(DIGEST_CHARACTERISTIC_UUID, self.digest)
+        return self
+
+# Client side
+
+class SyncStats(object):
+    def __init__(self):
+        self.pushes = 0
+        self.bytes_written = 0
+        self.bytes_verified = 0
+        self.digest_bytes = 0
+        self.readback_bytes = 0
+        self.sections_rewritten = 0
+
+    @property
+    def bytes_saved(self):
+        # Compared to reading the whole written payload back after each push.
+        return self.bytes_verified - self.digest_bytes - self.readback_bytes
+
+    def __repr__(self):
+        return (f"SyncStats(pushes={self.pushes},"
+            f" written={self.bytes_written}B,"
+            f" digest={self.digest_bytes}B,"
+            f" readback={self.readback_bytes}B,"
+            f" rewritten={self.sections_rewritten},"
+            f" saved={self.bytes_saved}B)")
+
+class ProfileVerificationError(Exception):
+    pass
+
+# Pushes profile sections over the command protocol and confirms them by
+# comparing the device digest with the locally computed one. Only sections
+# whose CRC differs are read back (as a ranged read) and rewritten.
+class ProfileSync(object):
+    def __init__(self, commands, client, n_bands, retries=3):
+        self.commands = commands
+        self.client = client
+        self.n_bands = n_bands
+        self.retries = retries
+        self.sent = None
+        self.stats = SyncStats()
+
+    # All changed sections go out as one OP_WRITE_SECTIONS command.
+    async def _write_sections(self, sections, indices):
+        if not indices:
+            return
+        await self.commands.request(OP_WRITE_SECTIONS,
+            encode_section_batch({i: sections[i] for i in indices}))
+        self.stats.bytes_written += sum(len(sections[i]) for i in indices)
+
+    async def _read_digest(self):
+        data = await self.client.read_gatt_char(DIGEST_CHARACTERISTIC_UUID)
+        self.stats.digest_bytes += len(data)
+        return struct.unpack("<I", data)[0]
+
+    async def _read_crcs(self):
+        data = await self.commands.request(OP_READ_CRCS)
+        self.stats.digest_bytes += len(data)
+        return decode_crcs(data)
+
+    async def _read_section(self, i):
+        data = await self.commands.request(OP_READ_RANGE,
+            RANGE.pack(i * self.n_bands, self.n_bands))
+        self.stats.readback_bytes += len(data)
+        return data
+
+    async def push(self, sections):
+        if self.sent is None:
+            changed = list(range(len(sections)))
+        else:
+            changed = [i for i, s in enumerate(sections) if s != self.sent[i]]
+        self.stats.pushes += 1
+        await self._write_sections(sections, changed)
+        self.stats.bytes_verified += sum(len(sections[i]) for i in changed)
+
+        expected = section_crcs(sections)
+        for attempt in range(self.retries + 1):
+            if await self._read_digest() == combine_crcs(expected):
+                self.sent = list(sections)
+                return changed
+            if attempt == self.retries:
+                break
+            crcs = await self._read_crcs()
+            mismatched = [i for i, (a, b) in enumerate(zip(crcs, expected))
+                if a != b]
+            values = await asyncio.gather(*[self._read_section(i)
+                for i in mismatched])
+            stale = [i for i, value in zip(mismatched, values)
+                if value != sections[i]]
+            self.stats.sections_rewritten += len(stale)
+            await self._write_sections(sections, stale)
+        raise ProfileVerificationError(
+            f"Profile digest still mismatched after {self.retries} attempts")
+
+############
+### DEMO ###
+############
+
+# Drops a fraction of section writes, to exercise the ranged fallback.
+class _LossyProfileStore(ProfileStore):
+    def __init__(self, n_bands, loss=0.02):
+        super().__init__(n_bands)
+        self.loss = loss
+
+    def apply_section(self, i, payload):
+        if random.random() >= self.loss:
+            super().apply_section(i, payload)
+
+async def demo(n_pushes=100, n_bands=8):
+    from sim_link import SimulatedLink
+    server = CommandServer()
+    _LossyProfileStore(n_bands).attach(server)
+    async with SimulatedLink(server) as link:
+        commands = PipelinedClient(link, CHARACTERISTIC_UUID)
+        await commands.start()
+        sync = ProfileSync(commands, link, n_bands)
+        sections = [bytes(n_bands) for _ in SECTION_NAMES]
+        for _ in range(n_pushes):
+            # Like calculate_gain: every field of one side changes.
+            side = random.randrange(2) * len(SECTION_NAMES) // 2
+            for i in range(side, side + len(SECTION_NAMES) // 2):
+                sections[i] = bytes(random.randrange(80)
+                    for _ in range(n_bands))
+            await sync.push(sections)
+        await commands.stop()
+    print(sync.stats)
+
+if __name__ == "__main__":
+    asyncio.run(demo())
@@ -1,10 +1,16 @@
-from bleak import BleakClient, BleakScanner
+from bleak import BleakClient
 import asyncio
+
+from scan_stream import ProximityRanking, stream_scan
+
 async def main():
-    devices = await BleakScanner.discover(timeout=10)
-    devices = sorted(devices, key=lambda d: d.rssi, reverse=True)
-    for i, d in enumerate(devices):
-        print (f"Device {i}: rssi={d.rssi} {d}")
+    ranking = ProximityRanking()
+    async for track in stream_scan(ranking, timeout=10, new_only=True):
+        print(f"New device: {track}")
+
+    for i, track in enumerate(ranking.ranked()):
+        print (f"Device {i}: rssi={track.rssi:.1f} {track.device}")
+        d = track.device
         if d.name is not None and d.name.startswith("ATC_C562B4"):
             print("Connecting to", d)
             client = BleakClient(d, timeout=30)
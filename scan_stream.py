@@ -0,0 +1,157 @@
+import asyncio
+from bisect import bisect_left, insort
+from collections import deque
+
+from ble_config import SERVICE_UUID
+
+# Number of RSSI samples kept per device for smoothing.
+RSSI_WINDOW = 8
+
+# Per-device RSSI history. The ring buffer keeps a running sum so the
+# smoothed (mean) RSSI is available in O(1) after every advertisement.
+class DeviceTrack(object):
+    def __init__(self, address, name=None, window=RSSI_WINDOW):
+        self.address = address
+        self.name = name
+        self.samples = deque(maxlen=window)
+        self.total = 0
+        self.count = 0
+        self.has_service = False
+        self.device = None
+        self.advertisement_data = None
+
+    def add_rssi(self, rssi):
+        if len(self.samples) == self.samples.maxlen:
+            self.total -= self.samples[0]
+        self.samples.append(rssi)
+        self.total += rssi
+        self.count += 1
+
+    @property
+    def rssi(self):
+        if not self.samples:
+            return None
+        return self.total / len(self.samples)
+
+    def __repr__(self):
+        return (f"DeviceTrack({self.name} ({self.address})"
+            f" rssi={self.rssi:.1f} n={self.count})")
+
+# Moves a track's key in a sorted ranking list (old_key None: insert).
+def _move(order, old_key, key):
+    if old_key is not None:
+        del order[bisect_left(order, old_key)]
+    insort(order, key)
+
+# Proximity ranking over all tracked devices. Tracks are kept in a list
+# sorted by smoothed RSSI (nearest first), plus a second one with only the
+# devices advertising our service. An update moves one entry: a bisect to
+# find it and its new place, and a list delete/insert (a memmove, O(n)
+# but tiny for the number of devices in range). nearest() is O(1) and
+# ranked() a copy, with no re-sort.
+class ProximityRanking(object):
+    def __init__(self, service_uuid=SERVICE_UUID, window=RSSI_WINDOW):
+        self.service_uuid = service_uuid.lower()
+        self.window = window
+        self.tracks = {}
+        # (-rssi, address), so ties are broken by address.
+        self._keys = {}
+        self._order = []
+        self._service_order = []
+
+    def update(self, device, advertisement_data):
+        track = self.tracks.get(device.address)
+        if track is None:
+            track = DeviceTrack(device.address, device.name, self.window)
+            self.tracks[device.address] = track
+        if device.name is not None:
+            track.name = device.name
+        track.device = device
+        track.advertisement_data = advertisement_data
+        had_service = track.has_service
+        if not track.has_service:
+            track.has_service = self.service_uuid in [
+                str(uuid).lower() for uuid in advertisement_data.service_uuids]
+
+        track.add_rssi(advertisement_data.rssi)
+        old_key = self._keys.get(track.address)
+        key = (-track.rssi, track.address)
+        self._keys[track.address] = key
+        _move(self._order, old_key, key)
+        if track.has_service:
+            _move(self._service_order, old_key if had_service else None,
+                key)
+        return track
+
+    def nearest(self):
+        if not self._order:
+            return None
+        return self.tracks[self._order[0][1]]
+
+    def nearest_with_service(self):
+        if not self._service_order:
+            return None
+        return self.tracks[self._service_order[0][1]]
+
+    def ranked(self):
+        return [self.tracks[address] for _, address in self._order]
+
+    def __len__(self):
+        return len(self.tracks)
+
+# Streams deduplicated scan results. Each advertisement updates the
+# ranking, and the updated DeviceTrack is yielded. Only the first
+# advertisement of a device is yielded when new_only is set.
+async def stream_scan(ranking=None, timeout=None, service_uuids=None,
+        new_only=False, queue_size=256):
+    from bleak import BleakScanner
+
+    if ranking is None:
+        ranking = ProximityRanking()
+    queue = asyncio.Queue(maxsize=queue_size)
+
+    def detection_callback(device, advertisement_data):
+        if queue.full():
+            # Drop the oldest advertisement instead of stalling the scanner.
+            queue.get_nowait()
+        queue.put_nowait((device, advertisement_data))
+
+    kwargs = {"detection_callback": detection_callback}
+    if service_uuids is not None:
+        kwargs["service_uuids"] = service_uuids
+    scanner = BleakScanner(**kwargs)
+
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    await scanner.start()
+    try:
+        while True:
+            if deadline is None:
+                device, advertisement_data = await queue.get()
+            else:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    device, advertisement_data = await asyncio.wait_for(
+                        queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    return
+            is_new = device.address not in ranking.tracks
+            track = ranking.update(device, advertisement_data)
+            if is_new or not new_only:
+                yield track
+    finally:
+        await scanner.stop()
+
+async def main():
+    ranking = ProximityRanking()
+    async for track in stream_scan(ranking, timeout=10, new_only=True):
+        print(f"New device: {track}")
+    for i, track in enumerate(ranking.ranked()):
+        print(f"Device {i}: {track}")
+    print(f"Nearest device advertising our service: "
+        f"{ranking.nearest_with_service()}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
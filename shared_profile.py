@@ -0,0 +1,220 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from fitting_profile import SECTION_NAMES
+
+# Profile and device telemetry shared between the GUI process and the BLE
+# process (two-process mode of ble_controller.py).
+#
+# Layout of the shared memory block:
+#
+#   profile seq (u64) | telemetry seq (u64) | profile sections (u8)
+#   | padding | telemetry (f64)
+#
+# Each region has a single writer (profile: GUI, telemetry: BLE process)
+# and is guarded by a seqlock: the writer makes the sequence odd while
+# writing and even again when done, and readers retry until they see the
+# same even sequence before and after copying. Only small control messages
+# (which section changed) go through the pipe.
+TELEMETRY_FIELDS = ["connected", "push_latency_ms", "writes", "updated"]
+
+class SharedProfile(object):
+    def __init__(self, n_bands, name=None, create=False,
+            n_sections=len(SECTION_NAMES)):
+        self.n_bands = n_bands
+        self.n_sections = n_sections
+        profile_offset = 16
+        profile_size = n_sections * n_bands
+        telemetry_offset = (profile_offset + profile_size + 7) // 8 * 8
+        size = telemetry_offset + 8 * len(TELEMETRY_FIELDS)
+
+        self.shm = shared_memory.SharedMemory(name=name, create=create,
+            size=size)
+        self.created = create
+        buf = self.shm.buf
+        self.seqs = np.ndarray((2,), np.uint64, buf, 0)
+        self.profile = np.ndarray((n_sections, n_bands), np.uint8, buf,
+            profile_offset)
+        self.telemetry = np.ndarray((len(TELEMETRY_FIELDS),), np.float64,
+            buf, telemetry_offset)
+        if create:
+            self.seqs[:] = 0
+            self.profile[:] = 0
+            self.telemetry[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @classmethod
+    def create(cls, n_bands):
+        return cls(n_bands, create=True)
+
+    @classmethod
+    def attach(cls, name, n_bands):
+        return cls(n_bands, name=name)
+
+    def close(self):
+        # Views must be released before the buffer can be closed.
+        del self.seqs, self.profile, self.telemetry
+        self.shm.close()
+        if self.created:
+            self.shm.unlink()
+
+    def _read(self, k, copy):
+        while True:
+            before = int(self.seqs[k])
+            if before & 1:
+                continue
+            out = copy()
+            if int(self.seqs[k]) == before:
+                return out
+
+    # Profile (GUI process writes)
+
+    def write_section(self, i, data):
+        self.seqs[0] += 1
+        self.profile[i] = np.frombuffer(data, np.uint8)
+        self.seqs[0] += 1
+
+    def read_section(self, i):
+        return self._read(0, lambda: self.profile[i].tobytes())
+
+    # Telemetry (BLE process writes)
+
+    def write_telemetry(self, **fields):
+        self.seqs[1] += 1
+        for field, value in fields.items():
+            self.telemetry[TELEMETRY_FIELDS.index(field)] = value
+        self.telemetry[TELEMETRY_FIELDS.index("updated")] = time.time()
+        self.seqs[1] += 1
+
+    def read_telemetry(self):
+        values = self._read(1, lambda: self.telemetry.tolist())
+        return dict(zip(TELEMETRY_FIELDS, values))
+
+# GUI side
+
+# Drop-in for LatestValuePushQueue on ControllerState.push_queue: the
+# section goes into shared memory and only its index is sent to the BLE
+# process. If that process has exited (e.g. the connection failed),
+# on_disconnect() is called once and further sections stay in shared
+# memory only.
+class SharedPushQueue(object):
+    def __init__(self, shared, conn, process=None, on_disconnect=None):
+        self.shared = shared
+        self.conn = conn
+        self.process = process
+        self.on_disconnect = on_disconnect
+        self.connected = True
+
+    def _disconnected(self):
+        self.connected = False
+        if self.on_disconnect is not None:
+            self.on_disconnect()
+
+    def submit(self, key, value):
+        self.shared.write_section(key, value)
+        if not self.connected:
+            return
+        if self.process is not None and not self.process.is_alive():
+            self._disconnected()
+            return
+        try:
+            self.conn.send(("dirty", key))
+        except (BrokenPipeError, OSError):
+            self._disconnected()
+
+# sections: initial profile (fitting_profile.encode_sections), written
+# before the BLE process starts.
+def start_ble_process(n_bands, address=None, interval=0.0075,
+        sections=None):
+    shared = SharedProfile.create(n_bands)
+    for i, section in enumerate(sections or []):
+        shared.write_section(i, section)
+    conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=ble_worker,
+        args=(shared.name, n_bands, child_conn, address, interval),
+        name="ble-worker", daemon=True)
+    process.start()
+    return shared, conn, process
+
+def stop_ble_process(shared, conn, process):
+    try:
+        try:
+            conn.send(("stop",))
+        except (BrokenPipeError, OSError):
+            pass # Already exited
+        process.join(timeout=5)
+    finally:
+        shared.close()
+
+# BLE side
+
+def ble_worker(name, n_bands, conn, address=None, interval=0.0075):
+    shared = SharedProfile.attach(name, n_bands)
+    try:
+        asyncio.run(_ble_worker(shared, conn, address, interval))
+    finally:
+        shared.close()
+
+async def _ble_worker(shared, conn, address, interval):
+    from command_protocol import CommandServer, PipelinedClient
+    from live_tuning import LatestValuePushQueue, profile_sender
+    from profile_sync import ProfileStore, ProfileSync
+
+    if address is None:
+        from sim_link import SimulatedLink
+        server = CommandServer()
+        ProfileStore(shared.n_bands).attach(server)
+        client = SimulatedLink(server, interval)
+    else:
+        from bleak import BleakClient
+        client = BleakClient(address)
+
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    async with client:
+        shared.write_telemetry(connected=1)
+        commands = PipelinedClient(client)
+        await commands.start()
+        # Pushes are verified by digest against the whole shared profile,
+        # which is synced once on connect.
+        sync = ProfileSync(commands, client, shared.n_bands)
+        sections = [shared.read_section(i) for i in range(shared.n_sections)]
+        await sync.push(sections)
+        send = profile_sender(sync, sections)
+
+        async def send_and_report(sections):
+            t0 = time.perf_counter()
+            await send(sections)
+            shared.write_telemetry(writes=queue.writes + 1,
+                push_latency_ms=(time.perf_counter() - t0) * 1e3)
+
+        queue = LatestValuePushQueue(send_and_report, interval).start()
+
+        # Control messages are received on a thread so the event loop only
+        # ever sees queue.submit() calls.
+        def receive():
+            while True:
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    break
+                if message[0] == "stop":
+                    break
+                if message[0] == "dirty":
+                    queue.submit(message[1], shared.read_section(message[1]))
+            loop.call_soon_threadsafe(stopped.set)
+
+        threading.Thread(target=receive, name="ble-control",
+            daemon=True).start()
+        await stopped.wait()
+        await queue.stop()
+        await commands.stop()
+    shared.write_telemetry(connected=0)
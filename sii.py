@@ -0,0 +1,106 @@
+import time
+
+import numpy as np
+
+from fitting_profile import FREQUENCIES
+
+# Speech Intelligibility Index (simplified ANSI S3.5) for the fitting grid.
+#
+# Band audibility is the part of the 30 dB speech dynamic range (peaks at
+# +15 dB) above threshold:
+#
+#   A = clip((speech + gain + 15 - threshold) / 30, 0, 1)
+#
+# and the index is the importance-weighted sum over bands.
+
+# Octave-band importance (ANSI S3.5 table 4, octave procedure) spread over
+# the fitting grid: the in-between bands (3 and 6 kHz) take a quarter of
+# each neighbouring octave's importance. Sums to 1.
+BAND_IMPORTANCE = {
+    250: 0.0617,
+    500: 0.1671,
+    1000: 0.2373,
+    2000: 0.2648 * 0.75,
+    3000: 0.2648 * 0.25 + 0.2142 * 0.25,
+    4000: 0.2142 * 0.5,
+    6000: 0.2142 * 0.25 + 0.0549 * 0.25,
+    8000: 0.0549 * 0.75,
+}
+
+SPEECH_PEAK_dB = 15
+SPEECH_RANGE_dB = 30
+
+def band_audibility(thresholds, gains, speech_dB=55):
+    return min(max((speech_dB + gains + SPEECH_PEAK_dB - thresholds)
+        / SPEECH_RANGE_dB, 0.0), 1.0)
+
+# Batch form: thresholds and gains are (..., bands); returns (...).
+def sii(thresholds, gains, speech_dB=55, frequencies=FREQUENCIES):
+    weights = np.array([BAND_IMPORTANCE[f] for f in frequencies])
+    audibility = np.clip((speech_dB + np.asarray(gains, dtype=float)
+        + SPEECH_PEAK_dB - np.asarray(thresholds, dtype=float))
+        / SPEECH_RANGE_dB, 0, 1)
+    return audibility @ weights
+
+# SII of one ear kept current under single-band edits: the weighted
+# contribution of every band is cached, and an edit recomputes only the
+# touched band and adjusts the total.
+class IncrementalSII(object):
+    def __init__(self, frequencies=FREQUENCIES, speech_dB=55):
+        self.weights = [BAND_IMPORTANCE[f] for f in frequencies]
+        self.speech_dB = speech_dB
+        self.contributions = [0.0] * len(frequencies)
+        self.value = 0.0
+
+    def update(self, band, threshold, gain):
+        contribution = self.weights[band] * band_audibility(threshold, gain,
+            self.speech_dB)
+        self.value += contribution - self.contributions[band]
+        self.contributions[band] = contribution
+        return self.value
+
+    def reset(self, thresholds, gains):
+        self.contributions = [w * band_audibility(t, g, self.speech_dB)
+            for w, t, g in zip(self.weights, thresholds, gains)]
+        self.value = sum(self.contributions)
+        return self.value
+
+#################
+### BENCHMARK ###
+#################
+def benchmark(n_edits=100000, n_ears=100000):
+    rng = np.random.default_rng(0)
+    n = len(FREQUENCIES)
+    bands = rng.integers(0, n, n_edits).tolist()
+    thresholds = rng.integers(0, 81, n_edits).tolist()
+    gains = rng.integers(0, 61, n_edits).tolist()
+
+    ear = IncrementalSII()
+    audiogram = [0] * n
+    moderate_gains = [0] * n
+    t0 = time.perf_counter()
+    for band, threshold, gain in zip(bands, thresholds, gains):
+        audiogram[band] = threshold
+        moderate_gains[band] = gain
+        ear.reset(audiogram, moderate_gains)
+    full = (time.perf_counter() - t0) / n_edits
+
+    ear = IncrementalSII()
+    t0 = time.perf_counter()
+    for band, threshold, gain in zip(bands, thresholds, gains):
+        ear.update(band, threshold, gain)
+    incremental = (time.perf_counter() - t0) / n_edits
+    drift = abs(ear.value - sii(audiogram, moderate_gains))
+
+    cohort_thresholds = rng.integers(0, 81, (n_ears, n))
+    cohort_gains = rng.integers(0, 61, (n_ears, n))
+    t0 = time.perf_counter()
+    sii(cohort_thresholds, cohort_gains)
+    batch = time.perf_counter() - t0
+
+    print(f"per edit: full {full * 1e6:.2f}us,"
+        f" incremental {incremental * 1e6:.2f}us (drift {drift:.1e})")
+    print(f"batch: {n_ears} ears in {batch * 1e3:.1f}ms")
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,201 @@
+import asyncio
+import itertools
+from collections import deque
+
+# Simulated BLE link used for benchmarks and tests without a radio.
+#
+# SimulatedLink exposes the subset of the BleakClient API the client code
+# uses (read_gatt_char, write_gatt_char, start_notify), and talks to a
+# server object implementing:
+#
+#     server.on_read(link, uuid) -> bytes
+#     server.on_write(link, uuid, data)
+#
+# The server pushes notifications back with link.notify(uuid, data).
+#
+# Traffic is exchanged in connection events every `interval` seconds, with
+# at most `packets_per_event` packets per direction per event. A request
+# reaches the server in the next event and its response comes back in the
+# event after that, so an ATT round trip costs about two intervals.
+#
+# Links created with the same SharedRadio also share its packet budget per
+# interval, like several connections to one peripheral sharing airtime.
+
+_central_ids = itertools.count(1)
+
+class SharedRadio(object):
+    def __init__(self, packets_per_interval, interval=0.0075):
+        self.packets_per_interval = packets_per_interval
+        self.interval = interval
+        self._window = None
+        self._left = 0
+
+    def take(self, n, now):
+        window = int(now / self.interval)
+        if window != self._window:
+            self._window = window
+            self._left = self.packets_per_interval
+        granted = min(n, self._left)
+        self._left -= granted
+        return granted
+
+class SimulatedLink(object):
+    def __init__(self, server, interval=0.0075, packets_per_event=4,
+            max_queue=64, identifier=None, radio=None):
+        self.server = server
+        self.radio = radio
+        self.interval = interval
+        self.packets_per_event = packets_per_event
+        self.max_queue = max_queue
+        if identifier is None:
+            identifier = f"central-{next(_central_ids)}"
+        self.identifier = identifier
+        self.is_connected = False
+
+        self.uplink = deque()
+        self.downlink = deque()
+        self.notify_callbacks = {}
+        self.events = 0
+        self._space = None
+        self._ticker = None
+
+    async def connect(self):
+        if self.is_connected:
+            return True
+        self._space = asyncio.Event()
+        self._space.set()
+        self.is_connected = True
+        self._ticker = asyncio.ensure_future(self._run())
+        connected = getattr(self.server, "on_connect", None)
+        if connected is not None:
+            connected(self)
+        return True
+
+    async def disconnect(self):
+        if not self.is_connected:
+            return True
+        self.is_connected = False
+        self._ticker.cancel()
+        try:
+            await self._ticker
+        except asyncio.CancelledError:
+            pass
+        self._ticker = None
+        disconnected = getattr(self.server, "on_disconnect", None)
+        if disconnected is not None:
+            disconnected(self)
+        for packet in list(self.uplink) + list(self.downlink):
+            future = packet[-1]
+            if future is not None and not future.done():
+                future.set_exception(ConnectionError("Disconnected"))
+        self.uplink.clear()
+        self.downlink.clear()
+        return True
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.disconnect()
+
+    async def _send(self, packet):
+        if not self.is_connected:
+            raise ConnectionError("Not connected")
+        while len(self.uplink) >= self.max_queue:
+            self._space.clear()
+            await self._space.wait()
+        self.uplink.append(packet)
+
+    async def read_gatt_char(self, uuid):
+        future = asyncio.get_running_loop().create_future()
+        await self._send(("read", str(uuid), None, future))
+        return await future
+
+    async def write_gatt_char(self, uuid, data, response=False):
+        if not response:
+            await self._send(("write", str(uuid), bytes(data), None))
+            return
+        future = asyncio.get_running_loop().create_future()
+        await self._send(("write", str(uuid), bytes(data), future))
+        await future
+
+    async def start_notify(self, uuid, callback):
+        self.notify_callbacks[str(uuid)] = callback
+
+    async def stop_notify(self, uuid):
+        self.notify_callbacks.pop(str(uuid), None)
+
+    # Called by the server side.
+    def notify(self, uuid, data):
+        if not self.is_connected:
+            return False
+        self.downlink.append(("notify", str(uuid), bytes(data), None))
+        return True
+
+    def _deliver_uplink(self, packet):
+        op, uuid, data, future = packet
+        try:
+            if op == "read":
+                result = self.server.on_read(self, uuid)
+            else:
+                self.server.on_write(self, uuid, data)
+                result = None
+        except Exception as e:
+            if future is None:
+                raise
+            self.downlink.append(("error", uuid, e, future))
+            return
+        if future is not None:
+            self.downlink.append(("response", uuid, result, future))
+
+    def _deliver_downlink(self, packet):
+        op, uuid, data, future = packet
+        if op == "notify":
+            callback = self.notify_callbacks.get(uuid)
+            if callback is not None:
+                callback(uuid, bytearray(data))
+        elif future.done():
+            pass
+        elif op == "error":
+            future.set_exception(data)
+        else:
+            future.set_result(None if data is None else bytearray(data))
+
+    def _budget(self, n):
+        n = min(self.packets_per_event, n)
+        if self.radio is not None:
+            n = self.radio.take(n, asyncio.get_running_loop().time())
+        return n
+
+    def tick(self):
+        # Responses queued during this event are delivered in the next one.
+        downlink = [self.downlink.popleft() for _ in
+            range(self._budget(len(self.downlink)))]
+        for _ in range(self._budget(len(self.uplink))):
+            self._deliver_uplink(self.uplink.popleft())
+        for packet in downlink:
+            self._deliver_downlink(packet)
+        self.events += 1
+        if len(self.uplink) < self.max_queue:
+            self._space.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_event = loop.time()
+        while True:
+            next_event += self.interval
+            await asyncio.sleep(max(0.0, next_event - loop.time()))
+            self.tick()
+
+# Single-value GATT server, equivalent to BluetoothServerDelegate's
+# read/write handling in backend_corebluetooth.py.
+class SimulatedServer(object):
+    def __init__(self, message="Hello from Mac Server!"):
+        self.message = message
+
+    def on_read(self, link, uuid):
+        return self.message.encode()
+
+    def on_write(self, link, uuid, data):
+        self.message = str(data, 'utf-8')
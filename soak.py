@@ -0,0 +1,123 @@
+import argparse
+import gc
+import random
+import sys
+import tracemalloc
+
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from ble_controller import ControllerState
+
+# Memory soak test for long fitting sessions: drives ControllerState
+# through a clinic day of threshold edits, gain clicks and gain
+# calculations (rendering with Agg instead of Tk) and fails if traced
+# memory keeps growing after warm-up.
+
+class _Widget(object):
+    def __init__(self):
+        self.text = ""
+
+    def get(self, start, end):
+        return self.text
+
+    def tag_add(self, tag, start, end):
+        pass
+
+class _Event(object):
+    def __init__(self, text):
+        self.widget = _Widget()
+        self.widget.text = text
+
+# Like FigureCanvasTkAgg, draw_idle only marks the canvas; the actual draw
+# happens on the next render() (Tk: when the event loop goes idle).
+class _IdleCanvas(FigureCanvasAgg):
+    dirty = False
+
+    def draw_idle(self, *args, **kwargs):
+        self.dirty = True
+
+def make_state(frequencies):
+    axes = [[], []]
+    canvases = [[], []]
+    for i in range(2):
+        for j in range(2):
+            fig = Figure(figsize=(5, 3.2))
+            canvas = _IdleCanvas(fig)
+            axes[i].append(fig.add_subplot())
+            canvases[i].append(canvas)
+    state = ControllerState(axes, canvases, frequencies)
+    state.status_label = {}
+    for side in ["left", "right"]:
+        for kind in ["mpo", "loud_gain", "moderate_gain", "soft_gain"]:
+            getattr(state, f"{side}_{kind}_labels").extend(
+                {} for _ in frequencies)
+    return state
+
+def edit(state, rng):
+    side = rng.choice(["left", "right"])
+    freq_i = rng.randrange(len(state.frequencies))
+    r = rng.random()
+    if r < 0.5:
+        state.update_threshold(side, freq_i, _Event(str(rng.randint(0, 80))))
+    elif r < 0.7:
+        state.gain_up(side, freq_i)
+    elif r < 0.9:
+        state.gain_down(side, freq_i)
+    else:
+        state.calculate_gain()
+
+def render(state):
+    for row in state.canvases:
+        for canvas in row:
+            if canvas.dirty:
+                canvas.dirty = False
+                canvas.draw()
+
+def soak(n_edits=5000, warmup=500, render_every=100, max_growth_kb=256,
+        seed=0):
+    rng = random.Random(seed)
+    state = make_state([250, 500, 1000, 2000, 3000, 4000, 6000, 8000])
+
+    def run(n):
+        for i in range(n):
+            edit(state, rng)
+            if i % render_every == 0:
+                render(state)
+
+    # Tracing starts before warm-up so that the caches and renderer state
+    # built on the first draws are in the baseline, not counted as growth.
+    # Both measurements are taken right after a render.
+    tracemalloc.start()
+    run(warmup)
+    render(state)
+    gc.collect()
+    baseline, _ = tracemalloc.get_traced_memory()
+    before = tracemalloc.take_snapshot()
+    run(n_edits)
+    render(state)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    growth_kb = (current - baseline) / 1024
+    print(f"{n_edits} edits: traced memory {baseline / 1024:.0f}KB ->"
+        f" {current / 1024:.0f}KB (growth {growth_kb:+.1f}KB,"
+        f" peak {peak / 1024:.0f}KB)")
+    if growth_kb > max_growth_kb:
+        print("Top allocation growth:")
+        for stat in after.compare_to(before, "lineno")[:10]:
+            print(f"  {stat}")
+        return False
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fitting session memory"
+        " soak test")
+    parser.add_argument("--edits", type=int, default=5000)
+    parser.add_argument("--max-growth-kb", type=int, default=256)
+    args = parser.parse_args()
+    sys.exit(0 if soak(args.edits, max_growth_kb=args.max_growth_kb) else 1)
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from audiogram_import import AudiogramFormatError, ImportStats, \
+    find_audiogram, import_audiograms, parse_frequency
+from fitting_profile import FREQUENCIES
+
+CSV_HEADER = "id,ear,250,500,1k,2000 Hz,3k,4k,6k,8000\n"
+
+def _import(path, **kwargs):
+    stats = ImportStats()
+    records = [(record_id, ear, thresholds.tolist())
+        for ids, ears, batch in import_audiograms(path, stats=stats, **kwargs)
+        for record_id, ear, thresholds in zip(ids, ears, batch)]
+    return records, stats
+
+def _write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+@pytest.mark.parametrize("text, hz", [("250", 250), ("1k", 1000),
+    ("1.5 kHz", 1500), ("8000 Hz", 8000), ("0", None), ("ear", None)])
+def test_parse_frequency(text, hz):
+    assert parse_frequency(text) == hz
+
+@pytest.mark.parametrize("batch_size", [1, 3, 4096])
+def test_csv_rejects(tmp_path, batch_size):
+    path = _write(tmp_path, "export.csv", CSV_HEADER
+        + "1,L,10,20,30,40,50,60,70,80\n"
+        + "2,L,10,20,30,40,50,60,70,95\n"   # Out of range
+        + "3,R,10,x,30,40,50,60,70,80\n"    # Non numeric
+        + "4,Q,10,20,30,40,50,60,70,80\n"   # Unknown ear
+        + "5,R,10,20\n"                     # Short row
+        + "6,R,,,,,,,,\n"                   # No thresholds
+        + "7,right,10,,30,40,50,60,70,80\n")
+    records, stats = _import(path, batch_size=batch_size)
+    assert [(record_id, ear) for record_id, ear, _ in records] \
+        == [("1", "left"), ("7", "right")]
+    assert records[0][2] == [10, 20, 30, 40, 50, 60, 70, 80]
+    assert records[1][2][1] == 20 # Interpolated between 250 and 1k
+    assert (stats.records, stats.rejected) == (2, 5)
+    assert sorted(error.split(":")[0] for error in stats.errors) \
+        == ["line 3", "line 4", "line 5", "line 6", "line 7"]
+
+def test_csv_quoted_cells(tmp_path):
+    path = _write(tmp_path, "export.csv", CSV_HEADER
+        + '"1, a",L,10,20,30,40,50,60,70,80\n'
+        + "2,R,10,20,30,40,50,60,70,80\n")
+    records, stats = _import(path)
+    assert [record_id for record_id, _, _ in records] == ["1, a", "2"]
+    assert stats.rejected == 0
+
+def test_csv_untested_grid_bands_are_nan(tmp_path):
+    path = _write(tmp_path, "export.csv", "patient,side,500,4000\n"
+        "1,AD,20,40\n")
+    [(_, ear, thresholds)], _ = _import(path)
+    assert ear == "right"
+    assert np.isnan(thresholds[FREQUENCIES.index(250)])
+    assert np.isnan(thresholds[FREQUENCIES.index(8000)])
+    assert thresholds[FREQUENCIES.index(1000)] \
+        == pytest.approx(20 + 20 / 3, abs=1e-4)
+
+def test_csv_without_ear_column(tmp_path):
+    path = _write(tmp_path, "export.csv", "id,250\n1,20\n")
+    with pytest.raises(AudiogramFormatError):
+        _import(path)
+
+def test_unknown_format(tmp_path):
+    path = _write(tmp_path, "export.txt", "")
+    with pytest.raises(AudiogramFormatError):
+        _import(path)
+
+def test_jsonl_rejects(tmp_path):
+    path = _write(tmp_path, "export.jsonl",
+        '{"id": 1, "ear": "left", "thresholds": {"250": 10, "8k": 60}}\n'
+        "not json\n"
+        '{"id": 2, "ear": "left"}\n'
+        '{"id": 3, "ear": "left", "thresholds": {"x": 10}}\n'
+        '{"id": 4, "ear": "left", "thresholds": {"250": 81}}\n'
+        "\n"
+        '{"id": 5, "ear": "up", "thresholds": {"250": 10}}\n')
+    records, stats = _import(path)
+    assert [record_id for record_id, _, _ in records] == [1]
+    assert stats.rejected == 5
+
+@pytest.mark.parametrize("name", ["empty.csv", "empty.xml"])
+def test_empty_file(tmp_path, name):
+    path = _write(tmp_path, name, "")
+    with pytest.raises(AudiogramFormatError):
+        _import(path)
+
+def test_csv_blank_header(tmp_path):
+    path = _write(tmp_path, "export.csv", "\n1,L,20\n")
+    with pytest.raises(AudiogramFormatError):
+        _import(path)
+
+def test_jsonl_bad_thresholds_are_rejected(tmp_path):
+    path = _write(tmp_path, "export.jsonl",
+        '{"id": 1, "ear": "left", "thresholds": [20, 30]}\n'
+        '{"id": 2, "ear": "left", "thresholds": "20"}\n'
+        '[1, 2]\n'
+        '{"id": 3, "ear": "left", "thresholds": {"250": 10}}\n')
+    records, stats = _import(path)
+    assert [record_id for record_id, _, _ in records] == [3]
+    assert stats.rejected == 3
+
+def test_truncated_xml(tmp_path):
+    path = _write(tmp_path, "export.xml", "<Export>"
+        '<Audiogram id="a" ear="right"><Point frequency="250" threshold="10"/>'
+        '</Audiogram><Audiogram id="b" ear="le')
+    stats = ImportStats()
+    batches = import_audiograms(path, batch_size=1, stats=stats)
+    ids, _, _ = next(batches)
+    assert ids == ["a"]
+    with pytest.raises(AudiogramFormatError):
+        next(batches)
+
+def test_xml(tmp_path):
+    path = _write(tmp_path, "export.xml", "<Export>"
+        '<Audiogram id="a" ear="right"><Point frequency="250" threshold="10"/>'
+        '<Point frequency="8k" threshold="60"/></Audiogram>'
+        '<Audiogram id="b" ear="left"><Point frequency="?" threshold="1"/>'
+        "</Audiogram>"
+        '<Audiogram id="c" ear="left"/>'
+        "</Export>")
+    records, stats = _import(path)
+    assert [(record_id, ear) for record_id, ear, _ in records] \
+        == [("a", "right")]
+    assert records[0][2][0] == 10 and records[0][2][-1] == 60
+    assert stats.rejected == 2
+
+def test_find_audiogram(tmp_path):
+    path = _write(tmp_path, "export.csv", CSV_HEADER
+        + "1,L,10,20,30,40,50,60,70,80\n"
+        + "2,L,11,20,30,40,50,60,70,80\n"
+        + "2,R,12,20,30,40,50,60,70,80\n")
+    found = find_audiogram(path, "2")
+    assert sorted(found) == ["left", "right"]
+    assert found["left"][0] == 11 and found["right"][0] == 12
+    assert list(find_audiogram(path)) == ["left"]
+    assert find_audiogram(path, "3") == {}
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from autofit import fit_gains, nal_r_target
+from fitting_profile import FREQUENCIES, MIN_GAIN_dB, MAX_GAIN_dB
+
+SPEECH_dB = 55
+HEADROOM_dB = 10
+MAX_SLOPE_dB = 15
+# Dykstra stops once a cycle moves nothing by more than the tolerance.
+EPS = 1e-2
+
+def _cohort(n_ears=300, seed=1):
+    rng = np.random.default_rng(seed)
+    n = len(FREQUENCIES)
+    audiograms = rng.uniform(0, 100, (n_ears, n)).round()
+    mpos = rng.integers(70, 121, (n_ears, n)).astype(float)
+    return audiograms, mpos
+
+def _check_constraints(g, mpos, eps):
+    assert g.min() >= MIN_GAIN_dB - eps
+    assert g.max() <= MAX_GAIN_dB + eps
+    upper = np.maximum(mpos - SPEECH_dB - HEADROOM_dB, MIN_GAIN_dB)
+    assert (g <= upper + eps).all()
+    assert np.abs(np.diff(g, axis=-1)).max() <= MAX_SLOPE_dB + eps
+
+@pytest.mark.parametrize("integer", [False, True])
+def test_constraints_hold(integer):
+    audiograms, mpos = _cohort()
+    g = fit_gains(audiograms, mpos, SPEECH_dB, headroom_dB=HEADROOM_dB,
+        max_slope_dB=MAX_SLOPE_dB, integer=integer)
+    assert g.shape == audiograms.shape
+    # Rounded gains meet the limits exactly.
+    _check_constraints(g, mpos, 0 if integer else EPS)
+    if integer:
+        assert (g == np.rint(g)).all()
+
+def test_unconstrained_target_is_kept():
+    audiograms = np.full(len(FREQUENCIES), 40.0)
+    mpos = np.full(len(FREQUENCIES), 130.0)
+    target = nal_r_target(audiograms)
+    assert np.abs(np.diff(target)).max() <= MAX_SLOPE_dB
+    np.testing.assert_allclose(fit_gains(audiograms, mpos), target,
+        atol=EPS)
+
+def test_low_mpo_leaves_minimum_gain():
+    audiograms = np.full(len(FREQUENCIES), 60.0)
+    mpos = np.full(len(FREQUENCIES), 60.0)
+    np.testing.assert_allclose(fit_gains(audiograms, mpos), MIN_GAIN_dB,
+        atol=EPS)
+
+def test_steep_loss_is_slope_limited():
+    audiograms = np.array([0, 0, 0, 100, 100, 100, 100, 100], dtype=float)
+    mpos = np.full(len(FREQUENCIES), 130.0)
+    for integer in (False, True):
+        g = fit_gains(audiograms, mpos, integer=integer)
+        assert np.abs(np.diff(g)).max() <= MAX_SLOPE_dB + EPS
+        assert np.abs(np.diff(nal_r_target(audiograms))).max() \
+            > MAX_SLOPE_dB
+
+@pytest.mark.parametrize("integer", [False, True])
+def test_batch_matches_per_ear(integer):
+    audiograms, mpos = _cohort(100)
+    batch = fit_gains(audiograms, mpos, integer=integer)
+    per_ear = np.array([fit_gains(a, m, integer=integer)
+        for a, m in zip(audiograms, mpos)])
+    if integer:
+        np.testing.assert_array_equal(batch, per_ear)
+    else:
+        np.testing.assert_allclose(batch, per_ear, atol=EPS)
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from coeff_compiler import BLOB_HEADER, CoefficientCompiler, decode_blob, \
+    LEVELS_dB
+from fitting_profile import FIELDS, SIDES, encode_section
+
+N_BANDS = 8
+
+def _sections(moderate, other=0):
+    values = {"audiogram": [40] * N_BANDS, "soft_gains": [other] * N_BANDS,
+        "moderate_gains": moderate, "loud_gains": [other] * N_BANDS,
+        "mpos": [100] * N_BANDS}
+    return [encode_section(field, values[field]) for side in SIDES
+        for field in FIELDS]
+
+def test_round_trip():
+    compiler = CoefficientCompiler()
+    sections = _sections([30] * N_BANDS)
+    blob = compiler.compile(sections)
+    assert len(blob) == compiler.size
+    decoded = decode_blob(blob)
+    assert decoded["sample_rate"] == compiler.sample_rate
+    assert decoded["levels"] == list(LEVELS_dB)
+    assert decoded["biquads"].shape == (2, N_BANDS, 5)
+    assert decoded["compression"].shape == (2, N_BANDS, len(LEVELS_dB))
+
+@pytest.mark.parametrize("moderate", [[30] * N_BANDS, [0] * N_BANDS,
+    [10, 20, 30, 40, 50, 60, 50, 40], [60, 0, 60, 0, 60, 0, 60, 0]])
+def test_cascade_hits_the_targets(moderate):
+    compiler = CoefficientCompiler()
+    sections = _sections(moderate)
+    error = compiler.centre_error_dB(compiler.compile(sections), sections)
+    # Quantization to 24 fractional bits adds next to nothing.
+    assert np.abs(error).max() <= compiler.tolerance_dB + 0.01
+
+def test_cache():
+    compiler = CoefficientCompiler(cache_size=1)
+    a, b = _sections([30] * N_BANDS), _sections([20] * N_BANDS)
+    assert compiler.compile(a) is compiler.compile(a)
+    compiler.compile(b)
+    compiler.compile(a)
+    assert (compiler.hits, compiler.misses) == (1, 3)
+
+def test_bad_magic():
+    blob = bytearray(CoefficientCompiler().compile(_sections([30] * N_BANDS)))
+    blob[:4] = b"XXXX"
+    with pytest.raises(ValueError):
+        decode_blob(bytes(blob))
+
+def test_truncated_blob():
+    blob = CoefficientCompiler().compile(_sections([30] * N_BANDS))
+    with pytest.raises(ValueError):
+        decode_blob(blob[:BLOB_HEADER.size + 10])
+
+def test_too_large_for_one_attribute():
+    with pytest.raises(ValueError):
+        CoefficientCompiler(channels=4)
+
+# Profiles with the same CRC must not share a cache entry.
+def test_cache_ignores_crc_collisions(monkeypatch):
+    import coeff_compiler
+    monkeypatch.setattr(coeff_compiler, "combine_crcs", lambda crcs: 0)
+    compiler = CoefficientCompiler()
+    a, b = _sections([30] * N_BANDS), _sections([20] * N_BANDS)
+    assert compiler.compile(a) != compiler.compile(b)
+    assert compiler.misses == 2
@@ -0,0 +1,45 @@
+import pytest
+
+from command_protocol import BATCH_MAGIC, FRAME_MAGIC, OP_PING, OP_WRITE, \
+    STATUS_ERROR, decode_batch, decode_frame, encode_batch, encode_frame, \
+    is_frame
+
+def test_frame_round_trip():
+    frame = encode_frame(0xFFFF, OP_WRITE, b"\x00\xa5payload", STATUS_ERROR)
+    assert is_frame(frame)
+    assert decode_frame(frame) == (0xFFFF, OP_WRITE, STATUS_ERROR,
+        b"\x00\xa5payload")
+
+def test_empty_payload():
+    assert decode_frame(encode_frame(7, OP_PING)) == (7, OP_PING, 0, b"")
+
+def test_bad_magic():
+    frame = bytearray(encode_frame(1, OP_PING))
+    frame[0] = BATCH_MAGIC
+    assert not is_frame(frame)
+    with pytest.raises(ValueError):
+        decode_frame(frame)
+
+def test_short_data_is_not_a_frame():
+    assert not is_frame(bytes([FRAME_MAGIC, 0]))
+    assert not is_frame(b"")
+
+def test_batch_round_trip():
+    frames = [encode_frame(i, OP_PING, bytes(i)) for i in range(20)]
+    assert decode_batch(encode_batch(frames)) == frames
+    assert decode_batch(memoryview(encode_batch(frames))) == frames
+
+def test_empty_batch():
+    assert decode_batch(encode_batch([])) == []
+
+@pytest.mark.parametrize("cut", [1, 2, 5])
+def test_truncated_batch(cut):
+    data = encode_batch([encode_frame(1, OP_PING, b"abc")] * 2)
+    with pytest.raises(ValueError):
+        decode_batch(data[:-cut])
+
+def test_batch_without_magic():
+    with pytest.raises(ValueError):
+        decode_batch(encode_frame(1, OP_PING))
+    with pytest.raises(ValueError):
+        decode_batch(b"")
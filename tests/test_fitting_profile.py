@@ -0,0 +1,17 @@
+import pytest
+
+from fitting_profile import FIELDS, MAX_GAIN_dB, MIN_GAIN_dB, \
+    decode_section, encode_section, step_gain
+
+@pytest.mark.parametrize("value, step, expected", [
+    (30, 1, 31), (30, -1, 29),
+    (MAX_GAIN_dB, 1, MAX_GAIN_dB), (MIN_GAIN_dB, -1, MIN_GAIN_dB),
+    # Outside the limits: never moved against the step.
+    (80, 1, 80), (80, -1, 79), (MIN_GAIN_dB - 5, 1, MIN_GAIN_dB - 4)])
+def test_step_gain(value, step, expected):
+    assert step_gain(value, step) == expected
+
+@pytest.mark.parametrize("field", FIELDS)
+def test_section_round_trip(field):
+    values = [0, 10, 20, 30, 40, 50, 60, 70]
+    assert decode_section(field, encode_section(field, values)) == values
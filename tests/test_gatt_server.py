@@ -0,0 +1,134 @@
+import asyncio
+
+from command_protocol import BATCH_MAGIC, OP_PING, OP_READ, OP_WRITE, \
+    PipelinedClient, decode_batch, decode_frame, encode_frame
+from gatt_server import MultiCentralServer
+from sim_link import SimulatedLink
+
+# Transport stub: records notifications, or refuses them when full.
+class _Sender(object):
+    def __init__(self):
+        self.sent = []
+        self.full = False
+
+    def __call__(self, data):
+        if self.full:
+            return False
+        self.sent.append(bytes(data))
+        return True
+
+    def frames(self):
+        frames = []
+        for data in self.sent:
+            frames.extend(decode_batch(data) if data[0] == BATCH_MAGIC
+                else [data])
+        return [decode_frame(frame) for frame in frames]
+
+def _connect(server, identifier):
+    send = _Sender()
+    session = server.session(identifier, send)
+    session.subscribed = True
+    return session, send
+
+def test_messages_are_isolated_per_central():
+    server = MultiCentralServer()
+    a, send_a = _connect(server, "a")
+    b, send_b = _connect(server, "b")
+    server.write(a, b"from a")
+    server.write(b, encode_frame(1, OP_WRITE, b"from b"))
+    server.write(a, encode_frame(2, OP_READ))
+    server.write(b, encode_frame(3, OP_READ))
+
+    assert a.message == "from a"
+    assert b.message == "from b"
+    assert server.read(a, server.characteristic_uuid) == b"from a"
+    assert [f[3] for f in send_a.frames()] == [b"from a"]
+    assert [(f[0], f[3]) for f in send_b.frames()] == \
+        [(1, b"from b"), (3, b"from b")]
+
+def test_simulated_centrals_are_isolated():
+    async def central(server, i):
+        async with SimulatedLink(server, 0.001) as link:
+            commands = PipelinedClient(link)
+            await commands.start()
+            for k in range(20):
+                await commands.write(f"{i}/{k}".encode())
+                assert await commands.read() == f"{i}/{k}".encode()
+            await commands.stop()
+
+    async def main():
+        server = MultiCentralServer(
+            schedule=asyncio.get_running_loop().call_soon)
+        await asyncio.gather(*[central(server, i) for i in range(4)])
+
+    asyncio.run(main())
+
+def test_flooding_central_does_not_starve_others():
+    scheduled = []
+    server = MultiCentralServer(schedule=scheduled.append, budget=4,
+        max_per_drain=16)
+    flood, send_flood = _connect(server, "flood")
+    quiet, send_quiet = _connect(server, "quiet")
+    for seq in range(100):
+        server.write(flood, encode_frame(seq, OP_PING))
+    for seq in range(6):
+        server.write(quiet, encode_frame(seq, OP_PING))
+
+    assert len(scheduled) == 1
+    scheduled.pop()()
+    # Round-robin, 4 frames each per round: the quiet central is fully
+    # served within the first drain (4 + 2), while the flooding one stops
+    # after the round that crosses max_per_drain and is rescheduled.
+    assert [f[0] for f in send_quiet.frames()] == list(range(6))
+    assert [f[0] for f in send_flood.frames()] == list(range(12))
+    assert len(flood.inbox) == 88
+    assert len(scheduled) == 1
+
+    while scheduled:
+        scheduled.pop()()
+    assert [f[0] for f in send_flood.frames()] == list(range(100))
+
+def test_batches_respect_max_payload():
+    scheduled = []
+    server = MultiCentralServer(schedule=scheduled.append, mtu=40,
+        max_per_drain=1000)
+    session, send = _connect(server, "a")
+    payloads = [bytes([i]) * (i % 12) for i in range(50)]
+    for seq, payload in enumerate(payloads):
+        server.write(session, encode_frame(seq, OP_PING, payload))
+    scheduled.pop()()
+
+    assert all(len(data) <= server.max_payload for data in send.sent)
+    assert any(data[0] == BATCH_MAGIC for data in send.sent)
+    assert len(send.sent) < len(payloads)
+    assert [(f[0], f[3]) for f in send.frames()] == list(enumerate(payloads))
+    assert session.notifications == len(send.sent)
+
+def test_frames_wait_for_subscription_and_link_space():
+    server = MultiCentralServer()
+    send = _Sender()
+    session = server.session("a", send)
+    assert not session.subscribed
+    server.write(session, encode_frame(1, OP_PING, b"early"))
+    assert send.sent == []
+
+    session.subscribed = True
+    send.full = True
+    server.flush(session)
+    assert send.sent == []
+    assert len(session.outbox) == 1
+
+    send.full = False
+    server.flush(session)
+    assert send.frames() == [(1, OP_PING, 0, b"early")]
+    assert not session.outbox
+
+def test_broadcast_skips_unsubscribed_centrals():
+    server = MultiCentralServer()
+    a, send_a = _connect(server, "a")
+    send_b = _Sender()
+    server.session("b", send_b)
+    frame = encode_frame(0, OP_PING, b"all")
+    server.broadcast(frame)
+    assert send_a.sent == [frame]
+    assert send_b.sent == []
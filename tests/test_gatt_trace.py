@@ -0,0 +1,86 @@
+import asyncio
+import struct
+
+import pytest
+
+from gatt_trace import HEADER, OP_NOTIFY, OP_READ, OP_READ_RESPONSE, \
+    OP_WRITE, OP_WRITE_NO_RESPONSE, TraceWriter, read_trace, replay_client
+
+UUID = "87654321-4321-8765-4321-FEDCBA987654"
+OTHER_UUID = "87654321-4321-8765-4321-fedcba987655"
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "session.gtrc"
+    ops = [(OP_READ, UUID, b""), (OP_READ_RESPONSE, UUID, b"hello"),
+        (OP_WRITE, OTHER_UUID, b"\x00" * 300),
+        (OP_WRITE_NO_RESPONSE, UUID, b"\xa5\x01"), (OP_NOTIFY, UUID, b"")]
+    with TraceWriter(path) as writer:
+        for op, uuid, payload in ops:
+            writer.record(op, uuid, payload)
+    records = list(read_trace(path))
+    assert [(op, uuid, payload) for _, op, uuid, payload in records] \
+        == [(op, uuid.lower(), payload) for op, uuid, payload in ops]
+    times = [t for t, _, _, _ in records]
+    assert times == sorted(times)
+
+def test_empty_trace(tmp_path):
+    path = tmp_path / "empty.gtrc"
+    TraceWriter(path).close()
+    assert list(read_trace(path)) == []
+
+# Cuts in the last record header and in its payload.
+@pytest.mark.parametrize("cut", [1, 2, 3, 6, 9])
+def test_truncated_record_ends_the_trace(tmp_path, cut):
+    path = tmp_path / "cut.gtrc"
+    with TraceWriter(path) as writer:
+        writer.record(OP_READ, UUID)
+        writer.record(OP_WRITE, UUID, b"abcd")
+    data = path.read_bytes()
+    path.write_bytes(data[:-cut])
+    assert [op for _, op, _, _ in read_trace(path)] == [OP_READ]
+
+def test_bad_magic(tmp_path):
+    path = tmp_path / "bad.gtrc"
+    path.write_bytes(HEADER.pack(b"NOPE", 1, 0.0))
+    with pytest.raises(ValueError):
+        list(read_trace(path))
+
+def test_bad_version(tmp_path):
+    path = tmp_path / "v2.gtrc"
+    path.write_bytes(HEADER.pack(b"GTRC", 2, 0.0))
+    with pytest.raises(ValueError):
+        list(read_trace(path))
+
+class _OrderClient(object):
+    def __init__(self):
+        self.ops = []
+
+    async def start_notify(self, uuid, callback):
+        pass
+
+    async def read_gatt_char(self, uuid):
+        self.ops.append(("read", uuid))
+        await asyncio.sleep(0)
+        return b"value"
+
+    async def write_gatt_char(self, uuid, data, response=False):
+        self.ops.append(("write", data, response))
+        await asyncio.sleep(0)
+
+@pytest.mark.parametrize("speed", [0, 100])
+def test_replay_keeps_request_order(speed):
+    records = []
+    for i in range(20):
+        t = i * 1e-3
+        records.append((t, OP_WRITE_NO_RESPONSE, UUID, struct.pack("<H", i)))
+        if i % 5 == 0:
+            records.append((t, OP_READ, UUID, b""))
+            records.append((t, OP_READ_RESPONSE, UUID, b"value"))
+    client = _OrderClient()
+    stats = asyncio.run(replay_client(records, client, speed))
+    expected = [("read", UUID) if op == OP_READ
+        else ("write", payload, False)
+        for _, op, _, payload in records if op != OP_READ_RESPONSE]
+    assert client.ops == expected
+    assert stats.mismatches == 0
+    assert stats.ops == len(expected)
@@ -0,0 +1,56 @@
+import asyncio
+
+from live_tuning import LatestValuePushQueue
+
+def test_coalesces_to_latest_value():
+    sent = []
+
+    async def send(batch):
+        sent.append(batch)
+        await asyncio.sleep(0.01)
+
+    async def run():
+        queue = LatestValuePushQueue(send, interval=0.001).start()
+        for value in range(10):
+            queue.submit(1, value)
+        queue.submit(2, "x")
+        assert await queue.stop()
+        return queue
+
+    queue = asyncio.run(run())
+    assert sent == [{1: 9, 2: "x"}]
+    assert (queue.submitted, queue.writes) == (11, 1)
+
+def test_drain_waits_for_in_flight_batch():
+    sent = []
+
+    async def send(batch):
+        await asyncio.sleep(0.05)
+        sent.append(batch)
+
+    async def run():
+        queue = LatestValuePushQueue(send, interval=0.001).start()
+        queue.submit(1, "a")
+        await asyncio.sleep(0.01) # Taken from pending, being sent
+        assert not queue.pending and queue.in_flight is not None
+        return await queue.stop()
+
+    assert asyncio.run(run())
+    assert sent == [{1: "a"}]
+
+def test_drain_gives_up_on_a_failing_link():
+    async def send(batch):
+        raise ConnectionError("link lost")
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        queue = LatestValuePushQueue(send, interval=0.001).start()
+        queue.submit(1, "a")
+        t0 = loop.time()
+        drained = await queue.stop(timeout=0.1)
+        return drained, loop.time() - t0, queue
+
+    drained, elapsed, queue = asyncio.run(run())
+    assert not drained
+    assert elapsed < 1.0
+    assert queue.pending and queue.writes == 0
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from command_protocol import CommandServer, PipelinedClient
+from fitting_profile import SECTION_NAMES
+from profile_sync import ProfileStore, ProfileSync, \
+    ProfileVerificationError, encode_section_batch
+from sim_link import SimulatedLink
+
+N_BANDS = 8
+
+def test_section_batch_round_trip():
+    store = ProfileStore(N_BANDS)
+    sections = {0: bytes(range(N_BANDS)), 9: bytes([60] * N_BANDS)}
+    store._write_section_batch(encode_section_batch(sections))
+    for i, section in sections.items():
+        assert store.section(i) == section
+    assert store.section(1) == bytes(N_BANDS)
+
+@pytest.mark.parametrize("length", [1, N_BANDS, N_BANDS + 2,
+    2 * (N_BANDS + 1) - 1])
+def test_malformed_batch_length(length):
+    store = ProfileStore(N_BANDS)
+    digest = store.digest()
+    payload = encode_section_batch({0: b"\x05" * N_BANDS,
+        1: b"\x06" * N_BANDS})[:length]
+    with pytest.raises(ValueError):
+        store._write_section_batch(payload)
+    # Nothing of a malformed batch is applied.
+    assert store.digest() == digest
+    assert store.section(0) == bytes(N_BANDS)
+
+def test_bad_section_index():
+    store = ProfileStore(N_BANDS)
+    payload = encode_section_batch({0: b"\x05" * N_BANDS,
+        store.n_sections: b"\x06" * N_BANDS})
+    with pytest.raises(ValueError):
+        store._write_section_batch(payload)
+    assert store.section(0) == bytes(N_BANDS)
+
+def test_empty_batch():
+    store = ProfileStore(N_BANDS)
+    assert store._write_section_batch(b"") == b""
+
+# Drops the first write to each section in `drop`.
+class _DroppingStore(ProfileStore):
+    def __init__(self, n_bands, drop):
+        super().__init__(n_bands)
+        self.drop = set(drop)
+
+    def apply_section(self, i, payload):
+        if i in self.drop:
+            self.drop.discard(i)
+            return
+        super().apply_section(i, payload)
+
+async def _push_all(store, pushes):
+    server = CommandServer()
+    store.attach(server)
+    async with SimulatedLink(server, 0.001) as link:
+        commands = PipelinedClient(link)
+        await commands.start()
+        sync = ProfileSync(commands, link, N_BANDS)
+        changed = [await sync.push(sections) for sections in pushes]
+        await commands.stop()
+    return sync, changed
+
+def _profile(value, n_sections=len(SECTION_NAMES)):
+    return [bytes([value + i] * N_BANDS) for i in range(n_sections)]
+
+def test_sync_verifies_by_digest():
+    store = ProfileStore(N_BANDS)
+    first = _profile(1)
+    second = list(first)
+    second[4] = bytes([50] * N_BANDS)
+    sync, changed = asyncio.run(_push_all(store, [first, second]))
+    assert changed == [list(range(len(first))), [4]]
+    assert [store.section(i) for i in range(len(second))] == second
+    stats = sync.stats
+    assert (stats.readback_bytes, stats.sections_rewritten) == (0, 0)
+    assert stats.bytes_written == stats.bytes_verified == 11 * N_BANDS
+    # One 4 byte digest per push instead of reading 88 bytes back.
+    assert stats.bytes_saved == 11 * N_BANDS - 2 * 4
+
+def test_dropped_write_is_read_back_and_rewritten():
+    store = _DroppingStore(N_BANDS, drop=[3])
+    sections = _profile(1)
+    sync, _ = asyncio.run(_push_all(store, [sections]))
+    assert [store.section(i) for i in range(len(sections))] == sections
+    stats = sync.stats
+    n = len(sections)
+    # Only the dropped section is read back (ranged) and rewritten.
+    assert stats.readback_bytes == N_BANDS
+    assert stats.sections_rewritten == 1
+    assert stats.bytes_written == (n + 1) * N_BANDS
+    # Digest, per-section CRCs, digest again.
+    assert stats.digest_bytes == 4 + 4 * n + 4
+    assert stats.bytes_saved == n * N_BANDS - (8 + 4 * n) - N_BANDS
+
+def test_sync_gives_up_after_retries():
+    store = ProfileStore(N_BANDS)
+    store.apply_section = lambda i, payload: None # Never applies
+    with pytest.raises(ProfileVerificationError):
+        asyncio.run(_push_all(store, [_profile(1)]))
@@ -0,0 +1,72 @@
+import random
+from types import SimpleNamespace
+
+from scan_stream import ProximityRanking
+
+SERVICE = "0000180d-0000-1000-8000-00805f9b34fb"
+
+def _advertise(ranking, address, rssi, service=False, name=None):
+    device = SimpleNamespace(address=address, name=name)
+    data = SimpleNamespace(rssi=rssi,
+        service_uuids=[SERVICE.upper()] if service else [])
+    return ranking.update(device, data)
+
+def _expected(tracks):
+    return sorted(tracks, key=lambda t: (-t.rssi, t.address))
+
+def test_empty_ranking():
+    ranking = ProximityRanking(SERVICE)
+    assert ranking.nearest() is None
+    assert ranking.nearest_with_service() is None
+    assert ranking.ranked() == []
+    assert len(ranking) == 0
+
+def test_smoothed_rssi_is_window_mean():
+    ranking = ProximityRanking(SERVICE, window=3)
+    for rssi in [-90, -60, -30, -30]:
+        track = _advertise(ranking, "a", rssi)
+    assert track.rssi == -40
+    assert track.count == 4
+
+def test_leader_drop_hands_over_to_next_nearest():
+    ranking = ProximityRanking(SERVICE, window=1)
+    _advertise(ranking, "a", -40)
+    _advertise(ranking, "b", -50, service=True)
+    _advertise(ranking, "c", -60, service=True)
+    assert ranking.nearest().address == "a"
+    assert ranking.nearest_with_service().address == "b"
+
+    _advertise(ranking, "a", -70)
+    _advertise(ranking, "b", -80)
+    assert ranking.nearest().address == "c"
+    assert ranking.nearest_with_service().address == "c"
+    assert [t.address for t in ranking.ranked()] == ["c", "a", "b"]
+
+def test_service_seen_after_first_advertisement():
+    ranking = ProximityRanking(SERVICE)
+    _advertise(ranking, "a", -50)
+    assert ranking.nearest_with_service() is None
+    _advertise(ranking, "a", -50, service=True)
+    # Later advertisements without the UUID keep the device eligible.
+    _advertise(ranking, "a", -50)
+    assert ranking.nearest_with_service().address == "a"
+    assert len(ranking._service_order) == 1
+
+def test_ranking_matches_full_sort():
+    rng = random.Random(0)
+    ranking = ProximityRanking(SERVICE)
+    addresses = [f"{i:02x}" for i in range(40)]
+    service = set(rng.sample(addresses, 10))
+    for _ in range(5000):
+        address = rng.choice(addresses)
+        _advertise(ranking, address, rng.randint(-100, -30),
+            service=address in service)
+
+        tracks = list(ranking.tracks.values())
+        ranked = ranking.ranked()
+        assert ranked == _expected(tracks)
+        assert ranking.nearest() is ranked[0]
+        with_service = _expected(t for t in tracks if t.has_service)
+        assert ranking.nearest_with_service() is \
+            (with_service[0] if with_service else None)
+    assert len(ranking) == len(addresses)
@@ -0,0 +1,48 @@
+import multiprocessing
+
+from shared_profile import SharedProfile
+
+# Large sections (64 KiB), so copying one is far from atomic and a reader
+# without the seqlock sees half-written ones.
+N_BANDS = 65536
+
+def _writer(name, n_writes, started):
+    shared = SharedProfile.attach(name, N_BANDS)
+    try:
+        started.set()
+        for i in range(n_writes):
+            shared.write_section(1, bytes([i % 256]) * N_BANDS)
+    finally:
+        shared.close()
+
+def test_reader_never_sees_a_torn_section():
+    shared = SharedProfile.create(N_BANDS)
+    try:
+        started = multiprocessing.Event()
+        writer = multiprocessing.Process(target=_writer,
+            args=(shared.name, 20000, started))
+        writer.start()
+        started.wait(10)
+        reads = 0
+        values = set()
+        while writer.is_alive() or reads == 0:
+            section = shared.read_section(1)
+            assert section == section[:1] * N_BANDS, "torn read"
+            values.add(section[0])
+            reads += 1
+        writer.join()
+        assert writer.exitcode == 0
+        # The reads overlapped with the writes.
+        assert len(values) > 1
+    finally:
+        shared.close()
+
+def test_telemetry_round_trip():
+    shared = SharedProfile.create(8)
+    try:
+        shared.write_telemetry(connected=1, writes=3)
+        telemetry = shared.read_telemetry()
+        assert telemetry["connected"] == 1 and telemetry["writes"] == 3
+        assert telemetry["updated"] > 0
+    finally:
+        shared.close()
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from fitting_profile import FREQUENCIES
+from sii import BAND_IMPORTANCE, IncrementalSII, sii
+
+def test_importance_sums_to_one():
+    assert sum(BAND_IMPORTANCE[f] for f in FREQUENCIES) == pytest.approx(1)
+
+def test_audibility_limits():
+    n = len(FREQUENCIES)
+    assert sii([0] * n, [0] * n) == pytest.approx(1)
+    assert sii([120] * n, [0] * n) == 0
+    # Threshold at the speech peak + half the range: half audible.
+    assert sii([55] * n, [0] * n) == pytest.approx(0.5)
+
+def test_incremental_matches_batch_over_edits():
+    rng = np.random.default_rng(0)
+    n = len(FREQUENCIES)
+    thresholds = rng.integers(0, 81, n).tolist()
+    gains = rng.integers(0, 61, n).tolist()
+    ear = IncrementalSII()
+    assert ear.reset(thresholds, gains) == pytest.approx(
+        sii(thresholds, gains), abs=1e-12)
+
+    for _ in range(10000):
+        band = int(rng.integers(n))
+        thresholds[band] = int(rng.integers(0, 81))
+        gains[band] = int(rng.integers(0, 61))
+        value = ear.update(band, thresholds[band], gains[band])
+        assert value == pytest.approx(sii(thresholds, gains), abs=1e-9)
+    assert ear.value == value
+
+def test_batch_matches_per_ear():
+    rng = np.random.default_rng(1)
+    thresholds = rng.integers(0, 81, (50, len(FREQUENCIES)))
+    gains = rng.integers(0, 61, (50, len(FREQUENCIES)))
+    np.testing.assert_allclose(sii(thresholds, gains),
+        [IncrementalSII().reset(t, g) for t, g in zip(thresholds, gains)])
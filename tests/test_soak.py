@@ -0,0 +1,6 @@
+from soak import soak
+
+# A short session, drawn after every edit so each render path runs many
+# times; the full clinic day runs with `python soak.py`.
+def test_rendering_every_edit_does_not_grow_memory():
+    assert soak(n_edits=25, warmup=10, render_every=1)